@@ -1,14 +1,18 @@
 #!/usr/bin/env python3
+import concurrent.futures
 import json
 import sys
+import time
 import singer
 import singer.utils as singer_utils
 from singer import metadata, metrics
 import tap_salesforce.salesforce
 from tap_salesforce.sync import (
     sync_stream, resume_syncing_bulk_query, get_stream_version)
+from tap_salesforce.output import OUTPUT_LOCK, SharedState, buffer_stdout, write_message, write_state
 from tap_salesforce.salesforce import Salesforce
 from tap_salesforce.salesforce.bulk import Bulk
+from tap_salesforce.salesforce.report_rest import get_catalog_report_metadata
 from tap_salesforce.salesforce.exceptions import (
     TapSalesforceException, TapSalesforceQuotaExceededException, TapSalesforceBulkAPIDisabledException)
 
@@ -81,6 +85,25 @@ def build_state(raw_state, catalog):
             state = singer.write_bookmark(
                 state, tap_stream_id, 'JobHighestBookmarkSeen', current_bookmark)
 
+        # Preserve state that deals with resuming an incomplete Bulk 2.0 job
+        if singer.get_bookmark(raw_state, tap_stream_id, 'Bulk2JobID'):
+            for key in ('Bulk2JobID', 'Bulk2Locator', 'JobHighestBookmarkSeen'):
+                state = singer.write_bookmark(
+                    state, tap_stream_id, key, singer.get_bookmark(raw_state, tap_stream_id, key))
+
+        # Preserve state that deals with resuming an incomplete REST full
+        # table sync in Id slices, along with the version its records use
+        if singer.get_bookmark(raw_state, tap_stream_id, 'RestIdBoundaries') is not None:
+            for key in ('RestIdBoundaries', 'RestIdSlicesSynced', 'version'):
+                state = singer.write_bookmark(
+                    state, tap_stream_id, key, singer.get_bookmark(raw_state, tap_stream_id, key))
+
+        # Preserve the REST query window sizes learned by previous runs
+        for key in ('QueryWindowSucceeded', 'QueryWindowFailed'):
+            if singer.get_bookmark(raw_state, tap_stream_id, key) is not None:
+                state = singer.write_bookmark(
+                    state, tap_stream_id, key, singer.get_bookmark(raw_state, tap_stream_id, key))
+
         if replication_method == 'INCREMENTAL':
             replication_key = catalog_metadata.get(
                 (), {}).get('replication-key')
@@ -161,7 +184,7 @@ def do_discover_report(sf):
             field, mdata, sf.source_type)
 
         # Compound Address fields and geolocations cannot be queried by the Bulk API, so we ignore them
-        if field['dataType'] in ("address", "location") and sf.api_type == tap_salesforce.salesforce.BULK_API_TYPE:
+        if field['dataType'] in ("address", "location") and sf.api_type in (tap_salesforce.salesforce.BULK_API_TYPE, tap_salesforce.salesforce.BULK2_API_TYPE):
             mdata.pop(('properties', field_name), None)
             continue
 
@@ -216,6 +239,18 @@ def do_discover_report(sf):
     mdata = metadata.write(
         mdata, (), 'table-key-properties', [])
 
+    # Reports can be synced incrementally by filtering on any of their date columns
+    replication_keys = [field_name for field_name, field in fields.items()
+                        if field['dataType'] in ('date', 'datetime') and field_name in properties]
+    if replication_keys:
+        mdata = metadata.write(
+            mdata, (), 'valid-replication-keys', replication_keys)
+
+    # Keep what syncs need from the describe, so they don't have to make it
+    report = get_catalog_report_metadata(report_description)
+    for key, value in report.items():
+        mdata = metadata.write(mdata, (), key, value)
+
     schema = {
         'type': 'object',
         'additionalProperties': False,
@@ -259,152 +294,163 @@ def do_discover_object(sf):
     entries = []
 
     # Check if the user has BULK API enabled
-    if sf.api_type == 'BULK' and not Bulk(sf).has_permissions():
+    if sf.api_type in ('BULK', 'BULK2') and not Bulk(sf).has_permissions():
         raise TapSalesforceBulkAPIDisabledException(
             'This client does not have Bulk API permissions, received "API_DISABLED_FOR_ORG" error code')
 
-    sobject_name = sf.object_name
-
     # Skip blacklisted SF objects depending on the api_type in use
     # ChangeEvent objects are not queryable via Bulk or REST (undocumented)
-    if sobject_name in sf.get_blacklisted_objects() or sobject_name.endswith("ChangeEvent"):
-        LOGGER.error("Getting requested object is not supported")
-        raise Exception("Getting requested object is not supported")
-
-    sobject_description = sf.describe()
-
-    # Cache customSetting and Tag objects to check for blacklisting after
-    # all objects have been described
-    if sobject_description.get("customSetting"):
-        sf_custom_setting_objects.append(sobject_name)
-    elif sobject_name.endswith("__Tag"):
-        relationship_field = next(
-            (f for f in sobject_description["fields"] if f.get(
-                "relationshipName") == "Item"),
-            None)
-        if relationship_field:
-            # Map {"Object":"Object__Tag"}
-            object_to_tag_references[relationship_field["referenceTo"]
-                                     [0]] = sobject_name
-
-    fields = sobject_description['fields']
-    replication_key = get_replication_key(sobject_name, fields)
-
-    unsupported_fields = set()
-    properties = {}
-    mdata = metadata.new()
+    for sobject_name in sf.object_names:
+        if sobject_name in sf.get_blacklisted_objects() or sobject_name.endswith("ChangeEvent"):
+            LOGGER.error("Getting requested object %s is not supported", sobject_name)
+            raise Exception("Getting requested object {} is not supported".format(sobject_name))
 
-    found_id_field = False
+    descriptions = sf.describe_objects(sf.object_names) if sf.composite_describe else None
 
-    # Loop over the object's fields
-    for f in fields:
-        field_name = f['name']
+    for sobject_name in sf.object_names:
+        if descriptions is not None:
+            sobject_description = descriptions[sobject_name]
+        else:
+            sobject_description = sf.describe(sobject_name)
+
+        # Cache customSetting and Tag objects to check for blacklisting after
+        # all objects have been described
+        if sobject_description.get("customSetting"):
+            sf_custom_setting_objects.append(sobject_name)
+        elif sobject_name.endswith("__Tag"):
+            relationship_field = next(
+                (f for f in sobject_description["fields"] if f.get(
+                    "relationshipName") == "Item"),
+                None)
+            if relationship_field:
+                # Map {"Object":"Object__Tag"}
+                object_to_tag_references[relationship_field["referenceTo"]
+                                         [0]] = sobject_name
+
+        fields = sobject_description['fields']
+        replication_key = get_replication_key(sobject_name, fields)
+
+        unsupported_fields = set()
+        properties = {}
+        mdata = metadata.new()
+
+        found_id_field = False
+
+        # Loop over the object's fields
+        for f in fields:
+            field_name = f['name']
+
+            if field_name == "Id":
+                found_id_field = True
+
+            property_schema, mdata = create_property_schema(
+                f, mdata, sf.source_type)
+
+            # Compound Address fields and geolocations cannot be queried by the Bulk API, so we ignore them
+            if f['type'] in ("address", "location") and sf.api_type in (tap_salesforce.salesforce.BULK_API_TYPE, tap_salesforce.salesforce.BULK2_API_TYPE):
+                mdata.pop(('properties', field_name), None)
+                continue
 
-        if field_name == "Id":
-            found_id_field = True
+            # Formula fields are computed row by row at query time, tag them so
+            # they can be deferred to a second query, see defer_calculated_fields
+            if f.get('calculated'):
+                mdata = metadata.write(
+                    mdata, ('properties', field_name), 'calculated', True)
 
-        property_schema, mdata = create_property_schema(
-            f, mdata, sf.source_type)
+            # we haven't been able to observe any records with a json field, so we
+            # are marking it as unavailable until we have an example to work with
+            if f['type'] == "json":
+                unsupported_fields.add(
+                    (field_name, 'do not currently support json fields - please contact support'))
 
-        # Compound Address fields and geolocations cannot be queried by the Bulk API, so we ignore them
-        if f['type'] in ("address", "location") and sf.api_type == tap_salesforce.salesforce.BULK_API_TYPE:
-            mdata.pop(('properties', field_name), None)
-            continue
+            # Blacklisted fields are dependent on the api_type being used
+            field_pair = (sobject_name, field_name)
+            if field_pair in sf.get_blacklisted_fields():
+                unsupported_fields.add(
+                    (field_name, sf.get_blacklisted_fields()[field_pair]))
 
-        # we haven't been able to observe any records with a json field, so we
-        # are marking it as unavailable until we have an example to work with
-        if f['type'] == "json":
-            unsupported_fields.add(
-                (field_name, 'do not currently support json fields - please contact support'))
+            inclusion = metadata.get(
+                mdata, ('properties', field_name), 'inclusion')
 
-        # Blacklisted fields are dependent on the api_type being used
-        field_pair = (sobject_name, field_name)
-        if field_pair in sf.get_blacklisted_fields():
-            unsupported_fields.add(
-                (field_name, sf.get_blacklisted_fields()[field_pair]))
+            if sf.select_fields_by_default and inclusion != 'unsupported':
+                mdata = metadata.write(
+                    mdata, ('properties', field_name), 'selected-by-default', True)
 
-        inclusion = metadata.get(
-            mdata, ('properties', field_name), 'inclusion')
+            properties[field_name] = property_schema
 
-        if sf.select_fields_by_default and inclusion != 'unsupported':
+        if replication_key:
             mdata = metadata.write(
-                mdata, ('properties', field_name), 'selected-by-default', True)
-
-        properties[field_name] = property_schema
-
-    if replication_key:
-        mdata = metadata.write(
-            mdata, ('properties', replication_key), 'inclusion', 'automatic')
-
-    # There are cases where compound fields are referenced by the associated
-    # subfields but are not actually present in the field list
-    field_name_set = {f['name'] for f in fields}
-    filtered_unsupported_fields = [
-        f for f in unsupported_fields if f[0] in field_name_set]
-    missing_unsupported_field_names = [
-        f[0] for f in unsupported_fields if f[0] not in field_name_set]
-
-    if missing_unsupported_field_names:
-        LOGGER.info("Ignoring the following unsupported fields for object %s as they are missing from the field list: %s",
-                    sobject_name,
-                    ', '.join(sorted(missing_unsupported_field_names)))
+                mdata, ('properties', replication_key), 'inclusion', 'automatic')
+
+        # There are cases where compound fields are referenced by the associated
+        # subfields but are not actually present in the field list
+        field_name_set = {f['name'] for f in fields}
+        filtered_unsupported_fields = [
+            f for f in unsupported_fields if f[0] in field_name_set]
+        missing_unsupported_field_names = [
+            f[0] for f in unsupported_fields if f[0] not in field_name_set]
+
+        if missing_unsupported_field_names:
+            LOGGER.info("Ignoring the following unsupported fields for object %s as they are missing from the field list: %s",
+                        sobject_name,
+                        ', '.join(sorted(missing_unsupported_field_names)))
+
+        if filtered_unsupported_fields:
+            LOGGER.info("Not syncing the following unsupported fields for object %s: %s",
+                        sobject_name,
+                        ', '.join(sorted([k for k, _ in filtered_unsupported_fields])))
+
+        # Salesforce Objects are skipped when they do not have an Id field
+        if not found_id_field:
+            LOGGER.info(
+                "Skipping Salesforce Object %s, as it has no Id field",
+                sobject_name)
+            raise Exception("Skipping Salesforce Object %s, as it has no Id field",
+                            sobject_name)
+
+        # Any property added to unsupported_fields has metadata generated and
+        # removed
+        for prop, description in filtered_unsupported_fields:
+            if metadata.get(mdata, ('properties', prop),
+                            'selected-by-default'):
+                metadata.delete(
+                    mdata, ('properties', prop), 'selected-by-default')
 
-    if filtered_unsupported_fields:
-        LOGGER.info("Not syncing the following unsupported fields for object %s: %s",
-                    sobject_name,
-                    ', '.join(sorted([k for k, _ in filtered_unsupported_fields])))
-
-    # Salesforce Objects are skipped when they do not have an Id field
-    if not found_id_field:
-        LOGGER.info(
-            "Skipping Salesforce Object %s, as it has no Id field",
-            sobject_name)
-        raise Exception("Skipping Salesforce Object %s, as it has no Id field",
-                        sobject_name)
-
-    # Any property added to unsupported_fields has metadata generated and
-    # removed
-    for prop, description in filtered_unsupported_fields:
-        if metadata.get(mdata, ('properties', prop),
-                        'selected-by-default'):
-            metadata.delete(
-                mdata, ('properties', prop), 'selected-by-default')
+            mdata = metadata.write(
+                mdata, ('properties', prop), 'unsupported-description', description)
+            mdata = metadata.write(
+                mdata, ('properties', prop), 'inclusion', 'unsupported')
 
-        mdata = metadata.write(
-            mdata, ('properties', prop), 'unsupported-description', description)
-        mdata = metadata.write(
-            mdata, ('properties', prop), 'inclusion', 'unsupported')
+        if replication_key:
+            mdata = metadata.write(
+                mdata, (), 'valid-replication-keys', [replication_key])
+        else:
+            mdata = metadata.write(
+                mdata,
+                (),
+                'forced-replication-method',
+                {
+                    'replication-method': 'FULL_TABLE',
+                    'reason': 'No replication keys found from the Salesforce API'})
 
-    if replication_key:
-        mdata = metadata.write(
-            mdata, (), 'valid-replication-keys', [replication_key])
-    else:
         mdata = metadata.write(
-            mdata,
-            (),
-            'forced-replication-method',
-            {
-                'replication-method': 'FULL_TABLE',
-                'reason': 'No replication keys found from the Salesforce API'})
+            mdata, (), 'table-key-properties', key_properties)
 
-    mdata = metadata.write(
-        mdata, (), 'table-key-properties', key_properties)
+        schema = {
+            'type': 'object',
+            'additionalProperties': False,
+            'properties': properties
+        }
 
-    schema = {
-        'type': 'object',
-        'additionalProperties': False,
-        'properties': properties
-    }
+        entry = {
+            'stream': sobject_name,
+            'tap_stream_id': sobject_name,
+            'schema': schema,
+            'metadata': metadata.to_list(mdata),
+            'column_order': [str(column) for column in properties]
+        }
 
-    entry = {
-        'stream': sobject_name,
-        'tap_stream_id': sobject_name,
-        'schema': schema,
-        'metadata': metadata.to_list(mdata),
-        'column_order': [str(column) for column in properties]
-    }
-
-    entries.append(entry)
+        entries.append(entry)
 
     # For each custom setting field, remove its associated tag from entries
     # See Blacklisting.md for more information
@@ -430,17 +476,9 @@ def do_sync(sf, catalog, state):
     else:
         LOGGER.info("Starting sync")
 
+    catalog_entries = []
     for catalog_entry in catalog["streams"]:
-        stream_version = get_stream_version(catalog_entry, state)
-        stream = catalog_entry['stream']
-        stream_alias = catalog_entry.get('stream_alias')
         stream_name = catalog_entry["tap_stream_id"]
-        activate_version_message = singer.ActivateVersionMessage(
-            stream=(stream_alias or stream), version=stream_version)
-
-        catalog_metadata = metadata.to_map(catalog_entry['metadata'])
-        replication_key = catalog_metadata.get((), {}).get('replication-key')
-
         mdata = metadata.to_map(catalog_entry['metadata'])
 
         if not stream_is_selected(mdata):
@@ -457,10 +495,88 @@ def do_sync(sf, catalog, state):
         else:
             LOGGER.info("%s: Starting", stream_name)
 
-        state["current_stream"] = stream_name
-        singer.write_state(state)
-        key_properties = metadata.to_map(catalog_entry['metadata']).get(
-            (), {}).get('table-key-properties')
+        catalog_entries.append(catalog_entry)
+
+    if sf.stream_concurrency > 1 and len(catalog_entries) > 1:
+        do_sync_concurrently(sf, catalog_entries, state)
+    else:
+        for catalog_entry in catalog_entries:
+            state["current_stream"] = catalog_entry["tap_stream_id"]
+            write_state(state)
+            sync_catalog_entry(sf, catalog_entry, state)
+
+    state["current_stream"] = None
+    write_state(state)
+    LOGGER.info("Finished sync")
+
+
+def do_sync_concurrently(sf, catalog_entries, state):
+    """Syncs up to stream_concurrency streams at once, sharing sf's session,
+    token and quota accounting. Bulk API queries are all started up front and
+    their streams are synced in the order the queries finish, while every
+    other stream is synced as soon as a worker is free."""
+    shared_state = SharedState(state, [e['tap_stream_id'] for e in catalog_entries])
+    bulk_entries = {}
+
+    if sf.api_type == tap_salesforce.salesforce.BULK_API_TYPE:
+        bulk = Bulk(sf)
+        bulk.check_bulk_quota_usage()
+        for catalog_entry in catalog_entries:
+            tap_stream_id = catalog_entry['tap_stream_id']
+            # A PK chunked job being resumed is synced from its own batches
+            if not singer.get_bookmark(state, tap_stream_id, 'JobID'):
+                bulk.start_query(catalog_entry, shared_state.stream_state(tap_stream_id))
+                bulk_entries[tap_stream_id] = catalog_entry
+        LOGGER.info("Started %d Bulk API queries", len(bulk_entries))
+
+    def sync_shared(catalog_entry):
+        tap_stream_id = catalog_entry['tap_stream_id']
+        stream_state = shared_state.stream_state(tap_stream_id)
+        with shared_state.syncing(tap_stream_id):
+            sync_catalog_entry(sf, catalog_entry, stream_state)
+            shared_state.finish(tap_stream_id, stream_state)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=sf.stream_concurrency) as executor:
+        futures = [executor.submit(sync_shared, catalog_entry)
+                   for catalog_entry in catalog_entries
+                   if catalog_entry['tap_stream_id'] not in bulk_entries]
+
+        def raise_failures():
+            for future in futures:
+                if future.done() and future.exception():
+                    for pending in futures:
+                        pending.cancel()
+                    raise future.exception()
+
+        try:
+            if bulk_entries:
+                for finished in Bulk(sf).iter_finished_queries():
+                    if isinstance(finished, float):
+                        time.sleep(min(finished, 1))
+                    else:
+                        futures.append(executor.submit(sync_shared, bulk_entries[finished]))
+                    raise_failures()
+
+            concurrent.futures.wait(futures, return_when=concurrent.futures.FIRST_EXCEPTION)
+            raise_failures()
+        finally:
+            sf.started_bulk_queries.clear()
+
+
+def sync_catalog_entry(sf, catalog_entry, state):
+    stream_version = get_stream_version(catalog_entry, state)
+    stream = catalog_entry['stream']
+    stream_alias = catalog_entry.get('stream_alias')
+    stream_name = catalog_entry["tap_stream_id"]
+    activate_version_message = singer.ActivateVersionMessage(
+        stream=(stream_alias or stream), version=stream_version)
+
+    catalog_metadata = metadata.to_map(catalog_entry['metadata'])
+    replication_key = catalog_metadata.get((), {}).get('replication-key')
+
+    key_properties = metadata.to_map(catalog_entry['metadata']).get(
+        (), {}).get('table-key-properties')
+    with OUTPUT_LOCK:
         singer.write_schema(
             stream,
             catalog_entry['schema'],
@@ -468,55 +584,51 @@ def do_sync(sf, catalog, state):
             replication_key,
             stream_alias)
 
-        job_id = singer.get_bookmark(
-            state, catalog_entry['tap_stream_id'], 'JobID')
-        if job_id:
-            with metrics.record_counter(stream) as counter:
-                LOGGER.info(
-                    "Found JobID from previous Bulk Query. Resuming sync for job: %s", job_id)
-                # Resuming a sync should clear out the remaining state once finished
-                counter = resume_syncing_bulk_query(
-                    sf, catalog_entry, job_id, state, counter)
-                LOGGER.info("%s: Completed sync (%s rows)",
-                            stream_name, counter.value)
-                # Remove Job info from state once we complete this resumed query. One of a few cases could have occurred:
-                # 1. The job succeeded, in which case make JobHighestBookmarkSeen the new bookmark
-                # 2. The job partially completed, in which case make JobHighestBookmarkSeen the new bookmark, or
-                #    existing bookmark if no bookmark exists for the Job.
-                # 3. The job completely failed, in which case maintain the existing bookmark, or None if no bookmark
-                state.get('bookmarks', {}).get(
-                    catalog_entry['tap_stream_id'], {}).pop('JobID', None)
-                state.get('bookmarks', {}).get(
-                    catalog_entry['tap_stream_id'], {}).pop('BatchIDs', None)
-                bookmark = state.get('bookmarks', {}).get(catalog_entry['tap_stream_id'], {}) \
-                                                     .pop('JobHighestBookmarkSeen', None)
-                existing_bookmark = state.get('bookmarks', {}).get(catalog_entry['tap_stream_id'], {}) \
-                                                              .pop(replication_key, None)
-                state = singer.write_bookmark(
-                    state,
-                    catalog_entry['tap_stream_id'],
-                    replication_key,
-                    bookmark or existing_bookmark)  # If job is removed, reset to existing bookmark or None
-                singer.write_state(state)
-        else:
-            # Tables with a replication_key or an empty bookmark will emit an
-            # activate_version at the beginning of their sync
-            bookmark_is_empty = state.get('bookmarks', {}).get(
-                catalog_entry['tap_stream_id']) is None
-
-            if replication_key or bookmark_is_empty:
-                singer.write_message(activate_version_message)
-                state = singer.write_bookmark(state,
-                                              catalog_entry['tap_stream_id'],
-                                              'version',
-                                              stream_version)
-            counter = sync_stream(sf, catalog_entry, state)
+    job_id = singer.get_bookmark(
+        state, catalog_entry['tap_stream_id'], 'JobID')
+    if job_id:
+        with metrics.record_counter(stream) as counter:
+            LOGGER.info(
+                "Found JobID from previous Bulk Query. Resuming sync for job: %s", job_id)
+            # Resuming a sync should clear out the remaining state once finished
+            counter = resume_syncing_bulk_query(
+                sf, catalog_entry, job_id, state, counter)
             LOGGER.info("%s: Completed sync (%s rows)",
                         stream_name, counter.value)
-
-    state["current_stream"] = None
-    singer.write_state(state)
-    LOGGER.info("Finished sync")
+            # Remove Job info from state once we complete this resumed query. One of a few cases could have occurred:
+            # 1. The job succeeded, in which case make JobHighestBookmarkSeen the new bookmark
+            # 2. The job partially completed, in which case make JobHighestBookmarkSeen the new bookmark, or
+            #    existing bookmark if no bookmark exists for the Job.
+            # 3. The job completely failed, in which case maintain the existing bookmark, or None if no bookmark
+            state.get('bookmarks', {}).get(
+                catalog_entry['tap_stream_id'], {}).pop('JobID', None)
+            state.get('bookmarks', {}).get(
+                catalog_entry['tap_stream_id'], {}).pop('BatchIDs', None)
+            bookmark = state.get('bookmarks', {}).get(catalog_entry['tap_stream_id'], {}) \
+                                                 .pop('JobHighestBookmarkSeen', None)
+            existing_bookmark = state.get('bookmarks', {}).get(catalog_entry['tap_stream_id'], {}) \
+                                                          .pop(replication_key, None)
+            state = singer.write_bookmark(
+                state,
+                catalog_entry['tap_stream_id'],
+                replication_key,
+                bookmark or existing_bookmark)  # If job is removed, reset to existing bookmark or None
+            write_state(state)
+    else:
+        # Tables with a replication_key or an empty bookmark will emit an
+        # activate_version at the beginning of their sync
+        bookmark_is_empty = state.get('bookmarks', {}).get(
+            catalog_entry['tap_stream_id']) is None
+
+        if replication_key or bookmark_is_empty:
+            write_message(activate_version_message)
+            state = singer.write_bookmark(state,
+                                          catalog_entry['tap_stream_id'],
+                                          'version',
+                                          stream_version)
+        counter = sync_stream(sf, catalog_entry, state)
+        LOGGER.info("%s: Completed sync (%s rows)",
+                    stream_name, counter.value)
 
 
 def main_impl():
@@ -537,7 +649,30 @@ def main_impl():
             api_type=CONFIG.get('api_type'),
             source_type=CONFIG.get('source_type'),
             object_name=CONFIG.get('object_name'),
-            report_id=CONFIG.get('report_id'))
+            report_id=CONFIG.get('report_id'),
+            bulk_result_download_concurrency=CONFIG.get('bulk_result_download_concurrency'),
+            pipelined_pk_chunking=CONFIG.get('pipelined_pk_chunking'),
+            bulk_spill_to_disk=CONFIG.get('bulk_spill_to_disk'),
+            bulk2_max_records=CONFIG.get('bulk2_max_records'),
+            state_checkpoint_records=CONFIG.get('state_checkpoint_records'),
+            state_checkpoint_seconds=CONFIG.get('state_checkpoint_seconds'),
+            bulk_result_chunk_size=CONFIG.get('bulk_result_chunk_size'),
+            defer_calculated_fields=CONFIG.get('defer_calculated_fields'),
+            rest_prefetch_pages=CONFIG.get('rest_prefetch_pages'),
+            rest_batch_size=CONFIG.get('rest_batch_size'),
+            rest_query_windows=CONFIG.get('rest_query_windows'),
+            rest_window_concurrency=CONFIG.get('rest_window_concurrency'),
+            rest_id_chunks=CONFIG.get('rest_id_chunks'),
+            stream_concurrency=CONFIG.get('stream_concurrency'),
+            describe_cache_dir=CONFIG.get('describe_cache_dir'),
+            describe_cache_max_age=CONFIG.get('describe_cache_max_age'),
+            describe_cache_max_bytes=CONFIG.get('describe_cache_max_bytes'),
+            composite_describe=CONFIG.get('composite_describe'),
+            report_slice_column=CONFIG.get('report_slice_column'),
+            report_slice_concurrency=CONFIG.get('report_slice_concurrency'),
+            report_async=CONFIG.get('report_async'),
+            token_cache_dir=CONFIG.get('token_cache_dir'),
+            token_cache_max_age=CONFIG.get('token_cache_max_age'))
 
         sf.login()
 
@@ -559,6 +694,7 @@ def main_impl():
                 stream['schema']['properties'] = new_properties
 
             state = build_state(args.state, catalog)
+            buffer_stdout()
             do_sync(sf, catalog, state)
     finally:
         if sf:
@@ -570,8 +706,6 @@ def main_impl():
                 LOGGER.debug(
                     "Replication used %s Bulk API jobs towards the Salesforce quota.",
                     sf.jobs_completed)
-            if sf.login_timer:
-                sf.login_timer.cancel()
 
 
 def main():
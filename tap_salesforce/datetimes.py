@@ -0,0 +1,90 @@
+import datetime
+import functools
+import re
+
+import singer.utils as singer_utils
+from singer.transform import string_to_datetime as singer_string_to_datetime
+
+DATETIME_CACHE_SIZE = 4096
+
+# The formats Salesforce emits: dates, and date-times with optional
+# fractional seconds and a Z, +0000 or +00:00 style offset
+SALESFORCE_DATETIME_RE = re.compile(
+    r'(\d{4})-(\d{2})-(\d{2})'
+    r'(?:[T ](\d{2}):(\d{2}):(\d{2})(?:\.(\d{1,6}))?'
+    r'(Z|[+-]\d{2}:?\d{2})?)?')
+
+# The format singer_utils.strftime writes and the transform normalizes
+# date-time fields to, e.g. 2020-01-01T00:00:00.000000Z
+NORMALIZED_DATETIME_RE = re.compile(r'\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}\.\d{6}Z')
+
+
+def _parse_salesforce_datetime(value):
+    """Parses a date-time in one of the Salesforce formats to a UTC datetime.
+    Returns None for anything else, including invalid dates."""
+    match = SALESFORCE_DATETIME_RE.fullmatch(value)
+    if match is None:
+        return None
+
+    year, month, day, hour, minute, second, fraction, offset = match.groups()
+    try:
+        dtime = datetime.datetime(int(year), int(month), int(day),
+                                  int(hour or 0), int(minute or 0), int(second or 0),
+                                  int(fraction.ljust(6, '0')) if fraction else 0,
+                                  tzinfo=datetime.timezone.utc)
+    except ValueError:
+        return None
+
+    if offset and offset != 'Z':
+        sign = -1 if offset[0] == '-' else 1
+        offset = offset.replace(':', '')
+        delta = datetime.timedelta(hours=int(offset[1:3]), minutes=int(offset[3:5]))
+        try:
+            dtime -= sign * delta
+        except OverflowError:
+            return None
+
+    return dtime
+
+
+def format_datetime(dtime):
+    """Same as singer_utils.strftime for a UTC datetime."""
+    return '{:04d}-{:02d}-{:02d}T{:02d}:{:02d}:{:02d}.{:06d}Z'.format(
+        dtime.year, dtime.month, dtime.day,
+        dtime.hour, dtime.minute, dtime.second, dtime.microsecond)
+
+
+@functools.lru_cache(maxsize=DATETIME_CACHE_SIZE)
+def _string_to_datetime(value):
+    dtime = _parse_salesforce_datetime(value)
+    if dtime is None:
+        return singer_string_to_datetime(value)
+    return format_datetime(dtime)
+
+
+def string_to_datetime(value):
+    """Same as singer.transform.string_to_datetime, which normalizes a
+    date-time string to UTC, with a fast path for the Salesforce formats and
+    a cache for repeated values."""
+    if value.__class__ is not str:
+        return singer_string_to_datetime(value)
+    return _string_to_datetime(value)
+
+
+def to_bookmark_key(value):
+    """Returns a date-time string as a normalized UTC string that compares
+    in the same order as the date-times, or None if there is no value.
+
+    Records' date-time fields have already been normalized by the transform
+    so they are returned as they are, without building a datetime."""
+    if not value:
+        return None
+    if NORMALIZED_DATETIME_RE.fullmatch(value):
+        return value
+
+    normalized = string_to_datetime(value)
+    if normalized is None:
+        # Let dateutil raise for anything that can't be parsed
+        normalized = singer_utils.strftime(
+            singer_utils.strptime_with_tz(value).astimezone(datetime.timezone.utc))
+    return normalized
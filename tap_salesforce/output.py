@@ -0,0 +1,141 @@
+import contextlib
+import copy
+import datetime
+import io
+import json
+import sys
+import threading
+
+import singer
+import singer.utils as singer_utils
+from singer.messages import format_message
+
+# Size of the buffer between RECORD messages and stdout
+STDOUT_BUFFER_SIZE = 1024 * 1024
+
+# Held while writing to stdout, so that the messages of streams synced on
+# several threads at once are never interleaved
+OUTPUT_LOCK = threading.RLock()
+
+# The SharedState, and the stream, that the current thread is syncing for
+_THREAD = threading.local()
+
+
+def buffer_stdout(buffer_size=STDOUT_BUFFER_SIZE):
+    """Replaces sys.stdout with one that has a larger buffer and is never line
+    buffered. singer.write_message flushes after every message it writes, so
+    STATE messages remain the points at which output is flushed."""
+    try:
+        fileno = sys.stdout.fileno()
+    except (AttributeError, io.UnsupportedOperation):
+        return
+
+    sys.stdout.flush()
+    sys.stdout = io.TextIOWrapper(
+        io.open(fileno, 'wb', buffering=buffer_size, closefd=False),
+        encoding=sys.stdout.encoding,
+        errors=sys.stdout.errors,
+        write_through=False)
+
+
+def write_message(message):
+    with OUTPUT_LOCK:
+        singer.write_message(message)
+
+
+def write_state(state):
+    """Same as singer.write_state, unless the current thread is syncing a
+    stream of a SharedState, in which case the stream's bookmarks are merged
+    into the shared state and that is written instead."""
+    syncing = getattr(_THREAD, 'syncing', None)
+    if syncing is None:
+        write_message(singer.StateMessage(value=state))
+        return
+
+    shared_state, tap_stream_id = syncing
+    shared_state.write(tap_stream_id, state)
+
+
+class SharedState():
+    """The state of streams that are synced on several threads at once.
+
+    Each stream is synced with a state of its own, holding only that stream's
+    bookmarks, so no thread ever changes a dict another thread is reading.
+    Writing the stream's state merges its bookmarks into the shared state,
+    whose current_stream is the first stream in the catalog that has not
+    finished syncing, so resuming from it never skips an unfinished stream."""
+
+    def __init__(self, state, tap_stream_ids):
+        self.state = state
+        self.unfinished = list(tap_stream_ids)
+
+    def stream_state(self, tap_stream_id):
+        with OUTPUT_LOCK:
+            bookmarks = self.state.get('bookmarks', {}).get(tap_stream_id)
+            if bookmarks is None:
+                return {}
+            return {'bookmarks': {tap_stream_id: copy.deepcopy(bookmarks)}}
+
+    @contextlib.contextmanager
+    def syncing(self, tap_stream_id):
+        """Makes write_state on the current thread write the shared state
+        with the bookmarks of tap_stream_id."""
+        _THREAD.syncing = (self, tap_stream_id)
+        try:
+            yield
+        finally:
+            _THREAD.syncing = None
+
+    def write(self, tap_stream_id, state):
+        bookmarks = state.get('bookmarks', {}).get(tap_stream_id)
+        with OUTPUT_LOCK:
+            if bookmarks is None:
+                self.state.get('bookmarks', {}).pop(tap_stream_id, None)
+            else:
+                self.state.setdefault('bookmarks', {})[tap_stream_id] = copy.deepcopy(bookmarks)
+            self.state['current_stream'] = self.unfinished[0] if self.unfinished else None
+            singer.write_message(singer.StateMessage(value=self.state))
+
+    def finish(self, tap_stream_id, state):
+        with OUTPUT_LOCK:
+            self.unfinished.remove(tap_stream_id)
+            self.write(tap_stream_id, state)
+
+
+class RecordWriter():
+    """Writes the RECORD messages of a stream, giving the same output as
+    singer.write_message with a singer.RecordMessage.
+
+    The parts of the message other than the record are serialized once per
+    stream. Records are serialized with the standard library's json module,
+    which is faster than the simplejson singer uses, and written without
+    flushing stdout."""
+
+    def __init__(self, stream, version=None, time_extracted=None):
+        self.stream = stream
+        self.version = version
+        self.time_extracted = time_extracted
+
+        self.prefix = '{"type": "RECORD", "stream": ' + json.dumps(stream) + ', "record": '
+        suffix = ''
+        if version is not None:
+            suffix += ', "version": ' + json.dumps(version)
+        if time_extracted:
+            suffix += ', "time_extracted": ' + json.dumps(singer_utils.strftime(
+                time_extracted.astimezone(datetime.timezone.utc)))
+        self.suffix = suffix + '}\n'
+
+    def write(self, record):
+        try:
+            line = self.prefix + json.dumps(record) + self.suffix
+        except (TypeError, ValueError):
+            # e.g. Decimals, which simplejson can write as numbers
+            line = format_message(singer.RecordMessage(stream=self.stream,
+                                                       record=record,
+                                                       version=self.version,
+                                                       time_extracted=self.time_extracted)) + '\n'
+        with OUTPUT_LOCK:
+            sys.stdout.write(line)
+
+    def flush(self): # pylint: disable=no-self-use
+        sys.stdout.flush()
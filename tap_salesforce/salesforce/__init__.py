@@ -1,3 +1,5 @@
+import concurrent.futures
+import json
 import re
 import threading
 import time
@@ -8,19 +10,48 @@ import singer
 import singer.utils as singer_utils
 from singer import metadata, metrics
 
-from tap_salesforce.salesforce.bulk import Bulk
+from tap_salesforce.salesforce.bulk import Bulk, DEFAULT_RESULT_CHUNK_SIZE
+from tap_salesforce.salesforce.bulk2 import Bulk2, DEFAULT_MAX_RECORDS
 from tap_salesforce.salesforce.rest import Rest
 from tap_salesforce.salesforce.report_rest import ReportRest
+from tap_salesforce.salesforce.describe_cache import DescribeCache
+from tap_salesforce.salesforce.token_cache import TokenCache
 from tap_salesforce.salesforce.exceptions import (
     TapSalesforceException,
     TapSalesforceQuotaExceededException)
 
 LOGGER = singer.get_logger()
 
-# The minimum expiration setting for SF Refresh Tokens is 15 minutes
-REFRESH_TOKEN_EXPIRATION_PERIOD = 900
+# Number of Bulk result files downloaded ahead of the record parser
+DEFAULT_BULK_RESULT_DOWNLOAD_CONCURRENCY = 4
+
+# Number of REST query pages requested ahead of the record parser
+DEFAULT_REST_PREFETCH_PAGES = 2
+
+# Number of replication key windows of a REST query that are read at once
+DEFAULT_REST_WINDOW_CONCURRENCY = 4
+
+# Number of slices of a report run at once
+DEFAULT_REPORT_SLICE_CONCURRENCY = 4
+
+# Number of records whose deferred calculated fields are queried at once
+DEFERRED_FIELDS_BATCH_SIZE = 200
+
+# A STATE message is written at most every this many records or seconds
+DEFAULT_STATE_CHECKPOINT_RECORDS = 10000
+DEFAULT_STATE_CHECKPOINT_SECONDS = 60
+
+# Describes sent per Composite Batch request, which is the most Salesforce
+# accepts, and the number of those requests made at once
+COMPOSITE_BATCH_SIZE = 25
+COMPOSITE_DESCRIBE_CONCURRENCY = 4
+
+# Connections the shared session keeps open for each stream synced at once,
+# which is the default pool size of a requests.Session
+CONNECTIONS_PER_STREAM = 10
 
 BULK_API_TYPE = "BULK"
+BULK2_API_TYPE = "BULK2"
 REST_API_TYPE = "REST"
 
 STRING_TYPES = set([
@@ -203,6 +234,60 @@ def field_to_property_schema(field, mdata, source_type):  # pylint:disable=too-m
     return property_schema, mdata
 
 
+def _is_blank(value):
+    return value is None or (isinstance(value, str) and value.strip() == '')
+
+
+def _positive_int(value, default, minimum=1):
+    """Parses an integer config value, which may be a string, to at least
+    minimum, or returns default if it is blank."""
+    if _is_blank(value):
+        return default
+    return max(minimum, int(value))
+
+
+def _float(value, default):
+    """Parses a number config value, which may be a string, or returns
+    default if it is blank."""
+    if _is_blank(value):
+        return default
+    return float(value)
+
+
+def _bool(value):
+    """Parses a boolean config value, which may be the string 'true'."""
+    return value is True or (isinstance(value, str) and value.lower() == 'true')
+
+
+def get_request_token(headers):
+    """Returns the access token a request is authorized with, if any."""
+    if not headers:
+        return None
+    if 'X-SFDC-Session' in headers:
+        return headers['X-SFDC-Session']
+    authorization = headers.get('Authorization', '')
+    if authorization.startswith('Bearer '):
+        return authorization[len('Bearer '):]
+    return None
+
+
+def with_access_token(headers, access_token):
+    """Returns a copy of a request's headers authorized with access_token."""
+    headers = dict(headers)
+    if 'X-SFDC-Session' in headers:
+        headers['X-SFDC-Session'] = access_token
+    else:
+        headers['Authorization'] = "Bearer {}".format(access_token)
+    return headers
+
+
+def is_invalid_session(resp):
+    """The REST APIs reject an expired access token with a 401, the Bulk
+    API with a 400 and an InvalidSessionId exception code."""
+    return resp.status_code == 401 or (
+        resp.status_code == 400 and 'InvalidSessionId' in resp.text)
+
+
 class Salesforce():
     # pylint: disable=too-many-instance-attributes,too-many-arguments
     def __init__(self,
@@ -218,48 +303,109 @@ class Salesforce():
                  api_type=None,
                  source_type=None,
                  object_name=None,
-                 report_id=None):
+                 report_id=None,
+                 bulk_result_download_concurrency=None,
+                 pipelined_pk_chunking=None,
+                 bulk_spill_to_disk=None,
+                 bulk2_max_records=None,
+                 state_checkpoint_records=None,
+                 state_checkpoint_seconds=None,
+                 bulk_result_chunk_size=None,
+                 defer_calculated_fields=None,
+                 rest_prefetch_pages=None,
+                 rest_batch_size=None,
+                 rest_query_windows=None,
+                 rest_window_concurrency=None,
+                 rest_id_chunks=None,
+                 stream_concurrency=None,
+                 describe_cache_dir=None,
+                 describe_cache_max_age=None,
+                 describe_cache_max_bytes=None,
+                 composite_describe=None,
+                 report_slice_column=None,
+                 report_slice_concurrency=None,
+                 report_async=None,
+                 token_cache_dir=None,
+                 token_cache_max_age=None):
         self.api_type = api_type.upper() if api_type else None
         self.refresh_token = refresh_token
         self.token = token
         self.sf_client_id = sf_client_id
         self.sf_client_secret = sf_client_secret
-        self.session = requests.Session()
+        self.stream_concurrency = _positive_int(stream_concurrency, 1)
+        self.session = self._create_session()
         self.access_token = None
         self.instance_url = None
-        if isinstance(quota_percent_per_run, str) and quota_percent_per_run.strip() == '':
-            quota_percent_per_run = None
-        if isinstance(quota_percent_total, str) and quota_percent_total.strip() == '':
-            quota_percent_total = None
-        self.quota_percent_per_run = float(
-            quota_percent_per_run) if quota_percent_per_run is not None else 25
-        self.quota_percent_total = float(
-            quota_percent_total) if quota_percent_total is not None else 80
-        self.is_sandbox = is_sandbox is True or (isinstance(
-            is_sandbox, str) and is_sandbox.lower() == 'true')
-        self.select_fields_by_default = select_fields_by_default is True or (isinstance(
-            select_fields_by_default, str) and select_fields_by_default.lower() == 'true')
+        self.org_id = None
+        self.describe_cache = DescribeCache(
+            describe_cache_dir,
+            _float(describe_cache_max_age, None),
+            _positive_int(describe_cache_max_bytes, None, minimum=0)) if describe_cache_dir else None
+        self.token_cache = TokenCache(
+            token_cache_dir,
+            _float(token_cache_max_age, None)) if token_cache_dir else None
+        # Guards refreshes of the access token, so requests rejected at once
+        # share a single refresh
+        self.login_lock = threading.Lock()
+        self.quota_percent_per_run = _float(quota_percent_per_run, 25)
+        self.quota_percent_total = _float(quota_percent_total, 80)
+        self.bulk_result_download_concurrency = _positive_int(
+            bulk_result_download_concurrency, DEFAULT_BULK_RESULT_DOWNLOAD_CONCURRENCY)
+        self.rest_prefetch_pages = _positive_int(rest_prefetch_pages, DEFAULT_REST_PREFETCH_PAGES, minimum=0)
+        self.rest_query_windows = _positive_int(rest_query_windows, 1)
+        self.rest_window_concurrency = _positive_int(rest_window_concurrency, DEFAULT_REST_WINDOW_CONCURRENCY)
+        self.rest_id_chunks = _positive_int(rest_id_chunks, 1)
+        self.report_slice_concurrency = _positive_int(report_slice_concurrency, DEFAULT_REPORT_SLICE_CONCURRENCY)
+        self.report_slice_column = report_slice_column if report_slice_column else None
+        self.rest_batch_size = _positive_int(rest_batch_size, None)
+        self.bulk_result_chunk_size = _positive_int(bulk_result_chunk_size, DEFAULT_RESULT_CHUNK_SIZE)
+        self.bulk2_max_records = _positive_int(bulk2_max_records, DEFAULT_MAX_RECORDS)
+        self.state_checkpoint_records = _positive_int(state_checkpoint_records, DEFAULT_STATE_CHECKPOINT_RECORDS)
+        self.state_checkpoint_seconds = _float(state_checkpoint_seconds, DEFAULT_STATE_CHECKPOINT_SECONDS)
+        self.is_sandbox = _bool(is_sandbox)
+        self.select_fields_by_default = _bool(select_fields_by_default)
+        self.pipelined_pk_chunking = _bool(pipelined_pk_chunking)
+        self.bulk_spill_to_disk = _bool(bulk_spill_to_disk)
+        self.defer_calculated_fields = _bool(defer_calculated_fields)
+        self.report_async = _bool(report_async)
+        self.composite_describe = _bool(composite_describe)
         self.default_start_date = default_start_date
         self.rest_requests_attempted = 0
         self.jobs_completed = 0
-        self.login_timer = None
+        # Guards the quota counters, which streams synced at once share
+        self.quota_lock = threading.Lock()
+        # Bulk queries started ahead of their streams' syncs, by tap_stream_id
+        self.started_bulk_queries = {}
         self.data_url = "{}/services/data/v41.0/{}"
-        self.pk_chunking = False
 
         self.source_type = source_type if source_type else None
         self.object_name = object_name if object_name else None
+        if isinstance(object_name, str):
+            object_name = [name.strip() for name in object_name.split(',') if name.strip()]
+        self.object_names = list(object_name) if object_name else []
         self.report_id = report_id if report_id else None
 
         # validate start_date
         singer_utils.strptime(default_start_date)
 
-        # Validate params
+        self._validate_source(source_type, report_id)
+
+    def _create_session(self):
+        session = requests.Session()
+        if self.stream_concurrency > 1:
+            adapter = requests.adapters.HTTPAdapter(
+                pool_maxsize=CONNECTIONS_PER_STREAM * self.stream_concurrency)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+        return session
+
+    def _validate_source(self, source_type, report_id):
         if source_type != 'object' and source_type != 'report':
             LOGGER.error(
                 'Invalid report_type, supported types are report & object')
             raise Exception(
                 'Invalid report_type, supported types are report & object')
-        if source_type == 'object' and object_name == None:
+        if source_type == 'object' and not self.object_names:
             LOGGER.error('Object name is required when source type is object')
             raise Exception(
                 'Object name is required when source type is object')
@@ -269,6 +415,12 @@ class Salesforce():
             raise Exception(
                 'Report id is required when source type is report')
 
+    @property
+    def login_url(self):
+        if self.is_sandbox:
+            return 'https://test.salesforce.com/services/oauth2/token'
+        return 'https://login.salesforce.com/services/oauth2/token'
+
     def _get_standard_headers(self):
         return {"Authorization": "Bearer {}".format(self.access_token)}
 
@@ -317,17 +469,16 @@ class Salesforce():
                           factor=2,
                           on_backoff=log_backoff_attempt)
     def _make_request(self, http_method, url, headers=None, body=None, stream=False, params=None):
-        if http_method == "GET":
-            LOGGER.info("Making %s request to %s with params: %s",
-                        http_method, url, params)
-            resp = self.session.get(
-                url, headers=headers, stream=stream, params=params)
-        elif http_method == "POST":
-            LOGGER.info("Making %s request to %s with body %s",
-                        http_method, url, body)
-            resp = self.session.post(url, headers=headers, data=body)
-        else:
-            raise TapSalesforceException("Unsupported HTTP method")
+        resp = self._send_request(http_method, url, headers, body, stream, params)
+
+        # An expired access token is refreshed the first time it is rejected,
+        # and the request is made again with the new one
+        request_token = get_request_token(headers)
+        if request_token is not None and is_invalid_session(resp):
+            LOGGER.info("Access token was rejected, refreshing it")
+            self.refresh_access_token(request_token)
+            resp = self._send_request(
+                http_method, url, with_access_token(headers, self.access_token), body, stream, params)
 
         try:
             resp.raise_for_status()
@@ -335,17 +486,53 @@ class Salesforce():
             raise ex
 
         if resp.headers.get('Sforce-Limit-Info') is not None:
-            self.rest_requests_attempted += 1
+            with self.quota_lock:
+                self.rest_requests_attempted += 1
             self.check_rest_quota_usage(resp.headers)
 
         return resp
 
-    def login(self):
-        if self.is_sandbox:
-            login_url = 'https://test.salesforce.com/services/oauth2/token'
-        else:
-            login_url = 'https://login.salesforce.com/services/oauth2/token'
+    def _send_request(self, http_method, url, headers, body, stream, params):
+        if http_method == "GET":
+            LOGGER.info("Making %s request to %s with params: %s",
+                        http_method, url, params)
+            return self.session.get(
+                url, headers=headers, stream=stream, params=params)
+        if http_method == "POST":
+            LOGGER.info("Making %s request to %s with body %s",
+                        http_method, url, body)
+            return self.session.post(url, headers=headers, data=body, stream=stream)
+        raise TapSalesforceException("Unsupported HTTP method")
 
+    def login(self):
+        """Uses the cached access token if there is one, or logs in."""
+        if self.token_cache is not None:
+            auth = self.token_cache.get(self.login_url, self.sf_client_id, self.refresh_token)
+            if auth is not None:
+                LOGGER.info("Using the cached OAuth2 access token")
+                self._set_auth(auth)
+                return
+
+        with self.login_lock:
+            self._refresh_access_token()
+
+    def refresh_access_token(self, rejected_token):
+        """Gets a new access token in place of rejected_token, unless another
+        request has already done so."""
+        with self.login_lock:
+            if self.access_token != rejected_token:
+                return
+            self._refresh_access_token()
+
+    def _set_auth(self, auth):
+        self.access_token = auth['access_token']
+        self.instance_url = auth['instance_url']
+        # The identity URL ends with the org and user ids
+        if auth.get('id'):
+            self.org_id = auth['id'].rstrip('/').split('/')[-2]
+
+    def _refresh_access_token(self):
+        login_url = self.login_url
         login_body = {'grant_type': 'refresh_token', 'client_id': self.sf_client_id,
                       'client_secret': self.sf_client_secret, 'refresh_token': self.refresh_token}
 
@@ -359,9 +546,7 @@ class Salesforce():
             LOGGER.info("OAuth2 login successful")
 
             auth = resp.json()
-
-            self.access_token = auth['access_token']
-            self.instance_url = auth['instance_url']
+            self._set_auth(auth)
         except Exception as e:
             error_message = str(e)
             if resp is None and hasattr(e, 'response') and e.response is not None:  # pylint:disable=no-member
@@ -371,19 +556,21 @@ class Salesforce():
                 error_message = error_message + \
                     ", Response from Salesforce: {}".format(resp.text)
             raise Exception(error_message) from e
-        finally:
-            LOGGER.info("Starting new login timer")
-            self.login_timer = threading.Timer(
-                REFRESH_TOKEN_EXPIRATION_PERIOD, self.login)
-            self.login_timer.start()
-
-    def describe(self):
-        """Describes a specific object or a specific report"""
+
+        if self.token_cache is not None:
+            self.token_cache.put(self.login_url, self.sf_client_id, self.refresh_token,
+                                 {key: auth[key] for key in ('access_token', 'instance_url', 'id')
+                                  if key in auth})
+
+    def describe(self, sobject_name=None):
+        """Describes a specific object, the first of object_name unless one
+        is given, or a specific report"""
         headers = self._get_standard_headers()
 
         if self.source_type == 'object':
-            endpoint = f'sobjects/{self.object_name}/describe'
-            endpoint_tag = self.object_name
+            sobject_name = sobject_name or self.object_names[0]
+            endpoint = f'sobjects/{sobject_name}/describe'
+            endpoint_tag = sobject_name
             url = self.data_url.format(self.instance_url, endpoint)
         elif self.source_type == 'report':
             endpoint = f'analytics/reports/{self.report_id}/describe'
@@ -392,20 +579,84 @@ class Salesforce():
 
         with metrics.http_request_timer("describe") as timer:
             timer.tags['endpoint'] = endpoint_tag
+            if self.describe_cache:
+                return self.describe_cache.get(
+                    self.org_id or self.instance_url,
+                    url,
+                    headers,
+                    lambda headers: self._make_request('GET', url, headers=headers))
             resp = self._make_request('GET', url, headers=headers)
 
         return resp.json()
 
+    def describe_objects(self, sobject_names):
+        """Describes several objects with Composite Batch requests of up to
+        COMPOSITE_BATCH_SIZE describes each, COMPOSITE_DESCRIBE_CONCURRENCY
+        requests at a time. Returns a dict of each object's describe, the same
+        as describe returns for it."""
+        batches = [sobject_names[i:i + COMPOSITE_BATCH_SIZE]
+                   for i in range(0, len(sobject_names), COMPOSITE_BATCH_SIZE)]
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=COMPOSITE_DESCRIBE_CONCURRENCY) as executor:
+            results = executor.map(self._describe_batch, batches)
+
+            descriptions = {}
+            for batch, batch_results in zip(batches, results):
+                descriptions.update(zip(batch, batch_results))
+
+        return descriptions
+
+    def _describe_batch(self, sobject_names):
+        headers = self._get_standard_headers()
+        headers['Content-Type'] = 'application/json'
+        url = self.data_url.format(self.instance_url, 'composite/batch')
+        body = {'batchRequests': [{'method': 'GET', 'url': f'v41.0/sobjects/{sobject_name}/describe'}
+                                  for sobject_name in sobject_names]}
+
+        with metrics.http_request_timer("describe") as timer:
+            timer.tags['endpoint'] = 'composite/batch'
+            resp = self._make_request('POST', url, headers=headers, body=json.dumps(body))
+
+        results = []
+        for sobject_name, result in zip(sobject_names, resp.json()['results']):
+            if result['statusCode'] != 200:
+                raise TapSalesforceException(
+                    "Error describing {}: {}".format(sobject_name, result['result']))
+            results.append(result['result'])
+
+        return results
+
     # pylint: disable=no-self-use
     def _get_selected_properties(self, catalog_entry):
         mdata = metadata.to_map(catalog_entry['metadata'])
         properties = catalog_entry['schema'].get('properties', {})
+        deferred_properties = self.get_deferred_properties(catalog_entry)
 
         return [k for k in properties.keys()
                 if singer.should_sync_field(metadata.get(mdata, ('properties', k), 'inclusion'),
                                             metadata.get(
                                                 mdata, ('properties', k), 'selected'),
-                                            self.select_fields_by_default)]
+                                            self.select_fields_by_default)
+                and k not in deferred_properties]
+
+    def get_deferred_properties(self, catalog_entry):
+        """Returns the selected calculated (formula) fields that are left out
+        of the main query and fetched by Id afterwards, if
+        defer_calculated_fields is set."""
+        if not self.defer_calculated_fields:
+            return []
+
+        mdata = metadata.to_map(catalog_entry['metadata'])
+        properties = catalog_entry['schema'].get('properties', {})
+        replication_key = mdata.get((), {}).get('replication-key')
+
+        return [k for k in properties.keys()
+                if metadata.get(mdata, ('properties', k), 'calculated')
+                and k not in ('Id', replication_key)
+                and singer.should_sync_field(metadata.get(mdata, ('properties', k), 'inclusion'),
+                                             metadata.get(
+                                                 mdata, ('properties', k), 'selected'),
+                                             self.select_fields_by_default)]
 
     def get_start_date(self, state, catalog_entry):
         catalog_metadata = metadata.to_map(catalog_entry['metadata'])
@@ -446,36 +697,73 @@ class Salesforce():
         if self.api_type == BULK_API_TYPE:
             bulk = Bulk(self)
             return bulk.query(catalog_entry, state)
+        elif self.api_type == BULK2_API_TYPE:
+            bulk2 = Bulk2(self)
+            return bulk2.query(catalog_entry, state)
         elif self.api_type == REST_API_TYPE:
             rest = Rest(self)
             return rest.query(catalog_entry, state)
         else:
             raise TapSalesforceException(
-                "api_type should be REST or BULK was: {}".format(
+                "api_type should be REST, BULK or BULK2 was: {}".format(
                     self.api_type))
 
+    def merge_deferred_fields(self, catalog_entry, records):
+        """Yields the records of one of the main query's batches or pages with
+        their deferred calculated fields added. The fields are queried through
+        the REST API by Id, DEFERRED_FIELDS_BATCH_SIZE records at a time.
+
+        The records of a batch or page are all yielded before the next one is
+        read, so the state written at its boundary still covers them."""
+        deferred_properties = self.get_deferred_properties(catalog_entry)
+        if not deferred_properties:
+            yield from records
+            return
+
+        batch = []
+        for rec in records:
+            batch.append(rec)
+            if len(batch) == DEFERRED_FIELDS_BATCH_SIZE:
+                yield from self._merge_deferred_batch(catalog_entry, deferred_properties, batch)
+                batch = []
+
+        if batch:
+            yield from self._merge_deferred_batch(catalog_entry, deferred_properties, batch)
+
+    def _merge_deferred_batch(self, catalog_entry, deferred_properties, batch):
+        rest = Rest(self)
+        deferred_records = {rec['Id']: rec for rec in rest.query_by_ids(
+            catalog_entry, deferred_properties, [rec['Id'] for rec in batch])}
+
+        for rec in batch:
+            # A record deleted since the main query was made has no values
+            deferred_rec = deferred_records.get(rec['Id'], {})
+            for prop in deferred_properties:
+                rec[prop] = deferred_rec.get(prop)
+            yield rec
+
     def query_report(self, catalog_entry, state):
         reportRest = ReportRest(self)
         return reportRest.query(catalog_entry, state)
 
     def get_blacklisted_objects(self):
-        if self.api_type == BULK_API_TYPE:
+        if self.api_type in (BULK_API_TYPE, BULK2_API_TYPE):
             return UNSUPPORTED_BULK_API_SALESFORCE_OBJECTS.union(
                 QUERY_RESTRICTED_SALESFORCE_OBJECTS).union(QUERY_INCOMPATIBLE_SALESFORCE_OBJECTS)
         elif self.api_type == REST_API_TYPE:
             return QUERY_RESTRICTED_SALESFORCE_OBJECTS.union(QUERY_INCOMPATIBLE_SALESFORCE_OBJECTS)
         else:
             raise TapSalesforceException(
-                "api_type should be REST or BULK was: {}".format(
+                "api_type should be REST, BULK or BULK2 was: {}".format(
                     self.api_type))
 
     # pylint: disable=line-too-long
     def get_blacklisted_fields(self):
-        if self.api_type == BULK_API_TYPE:
+        if self.api_type in (BULK_API_TYPE, BULK2_API_TYPE):
             return {('EntityDefinition', 'RecordTypesSupported'): "this field is unsupported by the Bulk API."}
         elif self.api_type == REST_API_TYPE:
             return {}
         else:
             raise TapSalesforceException(
-                "api_type should be REST or BULK was: {}".format(
+                "api_type should be REST, BULK or BULK2 was: {}".format(
                     self.api_type))
@@ -1,9 +1,14 @@
 # pylint: disable=protected-access
+import collections
+import concurrent.futures
+import contextlib
 import csv
+import functools
 import json
 import sys
 import time
 import tempfile
+import backoff
 import singer
 from singer import metrics
 import requests
@@ -12,11 +17,20 @@ from requests.exceptions import RequestException
 import xmltodict
 
 from tap_salesforce.salesforce.exceptions import (
-    TapSalesforceException, TapSalesforceQuotaExceededException)
+    TapSalesforceException, TapSalesforceQuotaExceededException, TapSalesforceBatchFailedException)
+from tap_salesforce.salesforce.polling import PollingScheduler
+from tap_salesforce.salesforce.result_buffer import ResultFileBuffer
+from tap_salesforce.output import write_state
 
+# Batch status polls back off from the MIN_SLEEP up to the SLEEP, see PollingScheduler
+BATCH_STATUS_POLLING_MIN_SLEEP = 2
 BATCH_STATUS_POLLING_SLEEP = 20
-PK_CHUNKED_BATCH_STATUS_POLLING_SLEEP = 60
-ITER_CHUNK_SIZE = 1024
+PK_CHUNKED_BATCH_STATUS_POLLING_MIN_SLEEP = 5
+PK_CHUNKED_BATCH_STATUS_POLLING_SLEEP = 120
+DEFAULT_RESULT_CHUNK_SIZE = 1024 * 1024
+# Unread bytes of a streamed result file held in memory, past which its
+# download waits for the parser
+RESULT_BUFFER_MEMORY = 16 * 1024 * 1024
 DEFAULT_CHUNK_SIZE = 100000 # Max is 250000
 
 LOGGER = singer.get_logger()
@@ -58,25 +72,34 @@ class Bulk():
         return True
 
     def query(self, catalog_entry, state):
-        self.check_bulk_quota_usage()
+        # Started queries had the quota checked when they were started
+        if catalog_entry['tap_stream_id'] not in self.sf.started_bulk_queries:
+            self.check_bulk_quota_usage()
 
         for record in self._bulk_query(catalog_entry, state):
             yield record
 
-        self.sf.jobs_completed += 1
+        with self.sf.quota_lock:
+            self.sf.jobs_completed += 1
 
     # pylint: disable=line-too-long
-    def check_bulk_quota_usage(self):
+    def check_bulk_quota_usage(self, limit_name='DailyBulkApiRequests', data_url=None):
+        """Checks the quota of limit_name, from the limits of the API
+        version of data_url, which defaults to the tap's."""
         endpoint = "limits"
-        url = self.sf.data_url.format(self.sf.instance_url, endpoint)
+        url = (data_url or self.sf.data_url).format(self.sf.instance_url, endpoint)
 
         with metrics.http_request_timer(endpoint):
             resp = self.sf._make_request('GET', url, headers=self.sf._get_standard_headers()).json()
 
-        quota_max = resp['DailyBulkApiRequests']['Max']
+        if limit_name not in resp:
+            raise TapSalesforceException(
+                "Salesforce did not report the {} limit at {}".format(limit_name, url))
+
+        quota_max = resp[limit_name]['Max']
         max_requests_for_run = int((self.sf.quota_percent_per_run * quota_max) / 100)
 
-        quota_remaining = resp['DailyBulkApiRequests']['Remaining']
+        quota_remaining = resp[limit_name]['Remaining']
         percent_used = (1 - (quota_remaining / quota_max)) * 100
 
         if percent_used > self.sf.quota_percent_total:
@@ -105,7 +128,9 @@ class Bulk():
                "Retried more than 15 times" in failure_message or \
                "Failed to write query result" in failure_message
 
-    def _bulk_query(self, catalog_entry, state):
+    def start_query(self, catalog_entry, state):
+        """Creates the job and batch of a stream's query ahead of its sync,
+        which picks them up from sf.started_bulk_queries."""
         job_id = self._create_job(catalog_entry)
         start_date = self.sf.get_start_date(state, catalog_entry)
 
@@ -113,35 +138,90 @@ class Bulk():
 
         self._close_job(job_id)
 
+        self.sf.started_bulk_queries[catalog_entry['tap_stream_id']] = (job_id, batch_id)
+
+    def iter_finished_queries(self):
+        """Polls the batches of sf.started_bulk_queries and yields the
+        tap_stream_id of each one as soon as its batch has finished, whether
+        it completed or failed. While none is ready it yields the number of
+        seconds until the next poll instead, like iter_completed_batches."""
+        remaining = dict(self.sf.started_bulk_queries)
+        next_poll = time.time()
+
+        with PollingScheduler(BATCH_STATUS_POLLING_MIN_SLEEP,
+                              BATCH_STATUS_POLLING_SLEEP) as scheduler:
+            while remaining:
+                wait = next_poll - time.time()
+                if wait > 0:
+                    yield wait
+                    continue
+
+                batches = {tap_stream_id: self._get_batch(job_id=job_id, batch_id=batch_id)
+                           for tap_stream_id, (job_id, batch_id) in remaining.items()}
+                scheduler.observe(list(batches.values()))
+                next_poll = time.time() + scheduler.next_interval()
+
+                for tap_stream_id, batch in batches.items():
+                    if batch['state'] in ['Completed', 'Failed', 'Not Processed']:
+                        del remaining[tap_stream_id]
+                        yield tap_stream_id
+
+    def _bulk_query(self, catalog_entry, state):
+        start_date = self.sf.get_start_date(state, catalog_entry)
+        started = self.sf.started_bulk_queries.pop(catalog_entry['tap_stream_id'], None)
+        if started:
+            job_id, batch_id = started
+        else:
+            job_id = self._create_job(catalog_entry)
+
+            batch_id = self._add_batch(catalog_entry, job_id, start_date)
+
+            self._close_job(job_id)
+
         batch_status = self._poll_on_batch_status(job_id, batch_id)
 
         if batch_status['state'] == 'Failed':
             if self._can_pk_chunk_job(batch_status['stateMessage']):
-                batch_status = self._bulk_query_with_pk_chunking(catalog_entry, start_date)
-                job_id = batch_status['job_id']
-
-                # Set pk_chunking to True to indicate that we should write a bookmark differently
-                self.sf.pk_chunking = True
+                if self.sf.pipelined_pk_chunking:
+                    job_id, batch_ids = self._bulk_query_with_pipelined_pk_chunking(catalog_entry, start_date)
+                    completed_batch_ids = self.iter_completed_batches(job_id, batch_ids)
+                else:
+                    batch_status = self._bulk_query_with_pk_chunking(catalog_entry, start_date)
+                    job_id = batch_status['job_id']
+                    batch_ids = completed_batch_ids = batch_status['completed']
 
                 # Add the bulk Job ID and its batches to the state so it can be resumed if necessary
                 tap_stream_id = catalog_entry['tap_stream_id']
                 state = singer.write_bookmark(state, tap_stream_id, 'JobID', job_id)
-                state = singer.write_bookmark(state, tap_stream_id, 'BatchIDs', batch_status['completed'][:])
-
-                for completed_batch_id in batch_status['completed']:
-                    for result in self.get_batch_results(job_id, completed_batch_id, catalog_entry):
-                        yield result
-                    # Remove the completed batch ID and write state
-                    state['bookmarks'][catalog_entry['tap_stream_id']]["BatchIDs"].remove(completed_batch_id)
-                    LOGGER.info("Finished syncing batch %s. Removing batch from state.", completed_batch_id)
-                    LOGGER.info("Batches to go: %d", len(state['bookmarks'][catalog_entry['tap_stream_id']]["BatchIDs"]))
-                    singer.write_state(state)
+                state = singer.write_bookmark(state, tap_stream_id, 'BatchIDs', batch_ids[:])
+                # The chunks' records are not ordered by the replication key, so the
+                # highest one seen only becomes the bookmark once they are all synced
+                state = singer.write_bookmark(state, tap_stream_id, 'JobHighestBookmarkSeen', start_date)
+
+                try:
+                    for completed_batch_id, records in self.iter_batches_results(job_id, completed_batch_ids, catalog_entry):
+                        for result in records:
+                            yield result
+                        # Remove the completed batch ID and write state
+                        state['bookmarks'][tap_stream_id]["BatchIDs"].remove(completed_batch_id)
+                        LOGGER.info("Finished syncing batch %s. Removing batch from state.", completed_batch_id)
+                        LOGGER.info("Batches to go: %d", len(state['bookmarks'][tap_stream_id]["BatchIDs"]))
+                        write_state(state)
+                except TapSalesforceBatchFailedException:
+                    # The job can't be resumed, so the next run starts over from the existing bookmark
+                    self.clear_job_state(state, tap_stream_id)
+                    write_state(state)
+                    raise
             else:
                 raise TapSalesforceException(batch_status['stateMessage'])
         else:
             for result in self.get_batch_results(job_id, batch_id, catalog_entry):
                 yield result
 
+    def clear_job_state(self, state, tap_stream_id): # pylint: disable=no-self-use
+        for key in ('JobID', 'BatchIDs', 'JobHighestBookmarkSeen'):
+            state.get('bookmarks', {}).get(tap_stream_id, {}).pop(key, None)
+
     def _bulk_query_with_pk_chunking(self, catalog_entry, start_date):
         LOGGER.info("Retrying Bulk Query with PK Chunking")
 
@@ -154,13 +234,68 @@ class Bulk():
         batch_status['job_id'] = job_id
 
         if batch_status['failed']:
-            raise TapSalesforceException("One or more batches failed during PK chunked job")
+            raise TapSalesforceBatchFailedException("One or more batches failed during PK chunked job")
 
         # Close the job after all the batches are complete
         self._close_job(job_id)
 
         return batch_status
 
+    def _bulk_query_with_pipelined_pk_chunking(self, catalog_entry, start_date):
+        """Starts a PK chunked job and returns its id along with the ids of the
+        chunk batches, without waiting for any of them to complete."""
+        LOGGER.info("Retrying Bulk Query with pipelined PK Chunking")
+
+        # Create a new job
+        job_id = self._create_job(catalog_entry, True)
+
+        batch_id = self._add_batch(catalog_entry, job_id, start_date, False)
+
+        # The original batch is marked 'Not Processed' once Salesforce has
+        # split the query up and created every chunk batch
+        batch_status = self._poll_on_batch_status(job_id, batch_id)
+
+        if batch_status['state'] == 'Failed':
+            raise TapSalesforceException(batch_status['stateMessage'])
+
+        batch_ids = [b['id'] for b in self._get_batches(job_id) if b['id'] != batch_id]
+
+        # No more batches will be added, the chunk batches keep processing
+        self._close_job(job_id)
+
+        return job_id, batch_ids
+
+    def iter_completed_batches(self, job_id, batch_ids):
+        """Polls the job's batches and yields each of the given batch_ids as
+        soon as it reaches 'Completed'. While none is ready it yields the
+        number of seconds until the next poll instead, so the caller can keep
+        working and only sleep once it is idle."""
+        remaining_batch_ids = set(batch_ids)
+        next_poll = time.time()
+
+        with PollingScheduler(PK_CHUNKED_BATCH_STATUS_POLLING_MIN_SLEEP,
+                              PK_CHUNKED_BATCH_STATUS_POLLING_SLEEP,
+                              {'job_id': job_id}) as scheduler:
+            while remaining_batch_ids:
+                wait = next_poll - time.time()
+                if wait > 0:
+                    yield wait
+                    continue
+
+                batches = self._get_batches(job_id)
+                scheduler.observe(batches)
+                next_poll = time.time() + scheduler.next_interval()
+
+                for batch in batches:
+                    if batch['id'] not in remaining_batch_ids:
+                        continue
+                    if batch['state'] == 'Completed':
+                        remaining_batch_ids.remove(batch['id'])
+                        yield batch['id']
+                    elif batch['state'] in ['Failed', 'Not Processed']:
+                        raise TapSalesforceBatchFailedException(
+                            "One or more batches failed during PK chunked job")
+
     def _create_job(self, catalog_entry, pk_chunking=False):
         url = self.bulk_url.format(self.sf.instance_url, "job")
         body = {"operation": "queryAll", "object": catalog_entry['stream'], "contentType": "CSV"}
@@ -208,28 +343,38 @@ class Bulk():
         return batch['batchInfo']['id']
 
     def _poll_on_pk_chunked_batch_status(self, job_id):
-        batches = self._get_batches(job_id)
-
-        while True:
-            queued_batches = [b['id'] for b in batches if b['state'] == "Queued"]
-            in_progress_batches = [b['id'] for b in batches if b['state'] == "InProgress"]
-
-            if not queued_batches and not in_progress_batches:
-                completed_batches = [b['id'] for b in batches if b['state'] == "Completed"]
-                failed_batches = [b['id'] for b in batches if b['state'] == "Failed"]
-                return {'completed': completed_batches, 'failed': failed_batches}
-            else:
-                time.sleep(PK_CHUNKED_BATCH_STATUS_POLLING_SLEEP)
-                batches = self._get_batches(job_id)
+        with PollingScheduler(PK_CHUNKED_BATCH_STATUS_POLLING_MIN_SLEEP,
+                              PK_CHUNKED_BATCH_STATUS_POLLING_SLEEP,
+                              {'job_id': job_id}) as scheduler:
+            batches = self._get_batches(job_id)
+            scheduler.observe(batches)
+
+            while True:
+                queued_batches = [b['id'] for b in batches if b['state'] == "Queued"]
+                in_progress_batches = [b['id'] for b in batches if b['state'] == "InProgress"]
+
+                if not queued_batches and not in_progress_batches:
+                    completed_batches = [b['id'] for b in batches if b['state'] == "Completed"]
+                    failed_batches = [b['id'] for b in batches if b['state'] == "Failed"]
+                    return {'completed': completed_batches, 'failed': failed_batches}
+                else:
+                    scheduler.wait()
+                    batches = self._get_batches(job_id)
+                    scheduler.observe(batches)
 
     def _poll_on_batch_status(self, job_id, batch_id):
-        batch_status = self._get_batch(job_id=job_id,
-                                       batch_id=batch_id)
-
-        while batch_status['state'] not in ['Completed', 'Failed', 'Not Processed']:
-            time.sleep(BATCH_STATUS_POLLING_SLEEP)
+        with PollingScheduler(BATCH_STATUS_POLLING_MIN_SLEEP,
+                              BATCH_STATUS_POLLING_SLEEP,
+                              {'job_id': job_id, 'batch_id': batch_id}) as scheduler:
             batch_status = self._get_batch(job_id=job_id,
                                            batch_id=batch_id)
+            scheduler.observe([batch_status])
+
+            while batch_status['state'] not in ['Completed', 'Failed', 'Not Processed']:
+                scheduler.wait()
+                batch_status = self._get_batch(job_id=job_id,
+                                               batch_id=batch_id)
+                scheduler.observe([batch_status])
 
         return batch_status
 
@@ -280,6 +425,93 @@ class Bulk():
     def get_batch_results(self, job_id, batch_id, catalog_entry):
         """Given a job_id and batch_id, queries the batches results and reads
         CSV lines yielding each line as a record."""
+        for _, records in self.iter_batches_results(job_id, [batch_id], catalog_entry):
+            for rec in records:
+                yield rec
+
+    def iter_batches_results(self, job_id, batch_ids, catalog_entry):
+        """Given a job_id and an iterable of batch_ids, yields a (batch_id,
+        records) pair for each batch in order. Result files are requested
+        ahead of the consumer by a bounded pool of workers, both within a
+        batch and across batches, so each records iterator must be exhausted
+        before the next pair is requested.
+
+        Rows are parsed as a worker downloads them into a bounded
+        ResultFileBuffer, and only the next result file is streamed ahead of
+        the one being parsed. If bulk_spill_to_disk asks for each file to be
+        downloaded in full first, bulk_result_download_concurrency files are
+        downloaded ahead instead.
+
+        batch_ids may also be a batch poller such as iter_completed_batches,
+        whose waits are only slept on once there is nothing left to parse."""
+        if self.sf.bulk_spill_to_disk:
+            ahead = self.sf.bulk_result_download_concurrency
+        else:
+            ahead = 1
+        batch_order = collections.deque()
+        pending = collections.deque()
+
+        def iter_result_files():
+            for batch_id in batch_ids:
+                if isinstance(batch_id, float):
+                    # No batch is ready yet, pass the poller's wait on
+                    yield None, batch_id
+                    continue
+                batch_order.append(batch_id)
+                for result in self._get_batch_result_list(job_id, batch_id, catalog_entry):
+                    yield batch_id, result
+
+        result_files = iter_result_files()
+
+        # The head of pending is the result file being parsed
+        def fill_pending():
+            while len(pending) <= ahead:
+                next_result_file = next(result_files, None)
+                if next_result_file is None:
+                    return
+                batch_id, result = next_result_file
+                if batch_id is None:
+                    if pending or batch_order:
+                        return
+                    time.sleep(result)
+                    continue
+                if self.sf.bulk_spill_to_disk:
+                    result_buffer = None
+                    future = executor.submit(self._spill_result_file, job_id, batch_id, result)
+                else:
+                    result_buffer = ResultFileBuffer(RESULT_BUFFER_MEMORY)
+                    future = executor.submit(self._download_result_file, job_id, batch_id, result, result_buffer)
+                pending.append((batch_id, future, result_buffer))
+
+        def batch_records(batch_id):
+            while pending and pending[0][0] == batch_id:
+                _, future, result_buffer = pending[0]
+                with result_buffer or future.result() as result_file:
+                    for rec in self._read_result_file(result_file):
+                        yield rec
+                pending.popleft()
+                fill_pending()
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=ahead + 1) as executor:
+            try:
+                fill_pending()
+                while batch_order:
+                    batch_id = batch_order.popleft()
+                    records = self.sf.merge_deferred_fields(catalog_entry, batch_records(batch_id))
+                    yield batch_id, records
+                    # Drain whatever the consumer left behind so the next
+                    # pair always starts at a batch boundary
+                    for _ in records:
+                        pass
+                    fill_pending()
+            finally:
+                for _, future, result_buffer in pending:
+                    if result_buffer is not None:
+                        result_buffer.close()
+                    elif not future.cancel() and future.exception() is None:
+                        future.result().close()
+
+    def _get_batch_result_list(self, job_id, batch_id, catalog_entry):
         headers = self._get_bulk_headers()
         endpoint = "job/{}/batch/{}/result".format(job_id, batch_id)
         url = self.bulk_url.format(self.sf.instance_url, endpoint)
@@ -295,28 +527,102 @@ class Bulk():
                                             xml_attribs=False,
                                             force_list={'result'})['result-list']
 
-        for result in batch_result_list['result']:
-            endpoint = "job/{}/batch/{}/result/{}".format(job_id, batch_id, result)
-            url = self.bulk_url.format(self.sf.instance_url, endpoint)
-            headers['Content-Type'] = 'text/csv'
+        return batch_result_list['result']
 
-            with tempfile.NamedTemporaryFile(mode="w+", encoding="utf8") as csv_file:
-                resp = self.sf._make_request('GET', url, headers=headers, stream=True)
-                for chunk in resp.iter_content(chunk_size=ITER_CHUNK_SIZE, decode_unicode=True):
-                    if chunk:
-                        # Replace any NULL bytes in the chunk so it can be safely given to the CSV reader
-                        csv_file.write(chunk.replace('\0', ''))
+    def _get_result_file_request(self, job_id, batch_id, result):
+        endpoint = "job/{}/batch/{}/result/{}".format(job_id, batch_id, result)
+        url = self.bulk_url.format(self.sf.instance_url, endpoint)
+        headers = self._get_bulk_headers()
+        headers['Content-Type'] = 'text/csv'
 
-                csv_file.seek(0)
-                csv_reader = csv.reader(csv_file,
-                                        delimiter=',',
-                                        quotechar='"')
+        return url, headers
 
-                column_name_list = next(csv_reader)
+    def _download_result_file(self, job_id, batch_id, result, result_buffer):
+        """Downloads a result file into result_buffer, from which its rows
+        are parsed while it is still downloading. Runs on the result download
+        workers."""
+        error = None
+        try:
+            if result_buffer.closed:
+                return
+            url, headers = self._get_result_file_request(job_id, batch_id, result)
+            with self.sf._make_request('GET', url, headers=headers, stream=True) as resp:
+                for chunk in self._iter_result_file_chunks(resp):
+                    if not result_buffer.write(chunk):
+                        break
+        except Exception as ex:
+            error = ex
+        finally:
+            result_buffer.finish(error)
+
+    @backoff.on_exception(backoff.expo,
+                          (requests.exceptions.ChunkedEncodingError,
+                           requests.exceptions.ConnectionError),
+                          max_tries=5,
+                          factor=2)
+    def _spill_result_file(self, job_id, batch_id, result):
+        """Downloads a whole result file into a temporary file, so a dropped
+        connection can be retried before any of its rows are emitted. Runs on
+        the result download workers."""
+        url, headers = self._get_result_file_request(job_id, batch_id, result)
+
+        with contextlib.ExitStack() as stack:
+            # The file is deleted on close, unless the whole download succeeds
+            csv_file = stack.enter_context(tempfile.NamedTemporaryFile(mode="w+b"))
+            with self.sf._make_request('GET', url, headers=headers, stream=True) as resp:
+                for chunk in self._iter_result_file_chunks(resp):
+                    # Remove any NULL bytes in the chunk so it can be safely given to the CSV reader
+                    csv_file.write(chunk.replace(b'\0', b''))
+
+            csv_file.seek(0)
+            stack.pop_all()
+
+        return csv_file
+
+    def _iter_result_file_chunks(self, response):
+        """Yields the raw bytes of a result file response in chunks of
+        bulk_result_chunk_size, then logs how fast it was read. Only the time
+        spent reading the response counts, not the time the chunks take to
+        be consumed."""
+        chunks = response.iter_content(chunk_size=self.sf.bulk_result_chunk_size)
+        seconds = 0
+        size = 0
+
+        while True:
+            start = time.time()
+            chunk = next(chunks, None)
+            seconds += time.time() - start
+            if chunk is None:
+                break
+            size += len(chunk)
+            yield chunk
+
+        tags = {'endpoint': 'result_file'}
+        metrics.log(LOGGER, metrics.Point('counter', 'result_file_bytes', size, tags))
+        metrics.log(LOGGER, metrics.Point('timer', 'result_file_read', seconds, tags))
+        LOGGER.info("Read %.1f MB of %s in %.1fs (%.2f MB/s)",
+                    size / 1048576,
+                    response.url,
+                    seconds,
+                    size / 1048576 / seconds if seconds else 0)
+
+    def _read_result_file(self, result_file):
+        if isinstance(result_file, requests.Response):
+            chunks = self._iter_result_file_chunks(result_file)
+        else:
+            chunks = iter(functools.partial(result_file.read, self.sf.bulk_result_chunk_size), b'')
+
+        csv_reader = csv.reader(self._iter_lines(chunks),
+                                delimiter=',',
+                                quotechar='"')
+
+        column_name_list = next(csv_reader, None)
+        if column_name_list is None:
+            return
 
-                for line in csv_reader:
-                    rec = dict(zip(column_name_list, line))
-                    yield rec
+        for line in csv_reader:
+            rec = dict(zip(column_name_list, line))
+            yield rec
 
     def _close_job(self, job_id):
         endpoint = "job/{}".format(job_id)
@@ -331,25 +637,34 @@ class Bulk():
                 body=json.dumps(body))
 
     # pylint: disable=no-self-use
-    def _iter_lines(self, response):
-        """Clone of the iter_lines function from the requests library with the change
-        to pass keepends=True in order to ensure that we do not strip the line breaks
-        from within a quoted value from the CSV stream."""
-        pending = None
-
-        for chunk in response.iter_content(decode_unicode=True, chunk_size=ITER_CHUNK_SIZE):
-            if pending is not None:
-                chunk = pending + chunk
-
-            lines = chunk.splitlines(keepends=True)
-
-            if lines and lines[-1] and chunk and lines[-1][-1] == chunk[-1]:
-                pending = lines.pop()
-            else:
-                pending = None
-
-            for line in lines:
-                yield line
-
-        if pending is not None:
-            yield pending
+    def _iter_lines(self, chunks):
+        """Yields the lines of a CSV result file, given as chunks of UTF-8
+        bytes, with their line breaks kept so csv.reader can rejoin quoted
+        values that span several lines. Unlike str.splitlines this only
+        splits on '\\n', as characters such as '\\x0c' or '\\u2028' may appear
+        unquoted inside a value.
+
+        NULL bytes are removed and each chunk is decoded up to its last line
+        break in one go. A '\\n' byte can't be part of a multi-byte UTF-8
+        character, so no character is ever split."""
+        pending = []
+
+        for chunk in chunks:
+            # Remove any NULL bytes so the stream can be safely given to the CSV reader
+            chunk = chunk.replace(b'\0', b'')
+            end = chunk.rfind(b'\n')
+
+            if end == -1:
+                pending.append(chunk)
+                continue
+
+            pending.append(chunk[:end])
+            text = b''.join(pending).decode('utf-8', 'replace')
+            pending = [chunk[end + 1:]]
+
+            for line in text.split('\n'):
+                yield line + '\n'
+
+        last_line = b''.join(pending)
+        if last_line:
+            yield last_line.decode('utf-8', 'replace')
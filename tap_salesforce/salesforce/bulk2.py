@@ -0,0 +1,163 @@
+# pylint: disable=protected-access
+import json
+import singer
+from singer import metrics
+from requests.exceptions import HTTPError
+
+from tap_salesforce.salesforce.bulk import Bulk
+from tap_salesforce.salesforce.exceptions import TapSalesforceException
+from tap_salesforce.salesforce.polling import PollingScheduler
+from tap_salesforce.output import write_state
+
+JOB_STATUS_POLLING_MIN_SLEEP = 2
+JOB_STATUS_POLLING_SLEEP = 60
+DEFAULT_MAX_RECORDS = 100000
+
+LOGGER = singer.get_logger()
+
+
+class Bulk2():
+    """Queries an object through the Bulk API 2.0. Salesforce splits the
+    query up server-side and the results are read back one locator-delimited
+    page at a time, with the next locator saved in state after each page so
+    an interrupted sync can resume from it."""
+
+    bulk2_url = "{}/services/data/v48.0/jobs/query{}"
+    # DailyBulkV2QueryJobs is only in the limits from API version 47.0 on
+    data_url = "{}/services/data/v48.0/{}"
+
+    def __init__(self, sf):
+        self.sf = sf
+        # The CSV handling is shared with the original Bulk API
+        self.bulk = Bulk(sf)
+
+    def query(self, catalog_entry, state):
+        self.bulk.check_bulk_quota_usage('DailyBulkV2QueryJobs', self.data_url)
+
+        for record in self._bulk2_query(catalog_entry, state):
+            yield record
+
+        with self.sf.quota_lock:
+            self.sf.jobs_completed += 1
+
+    def _bulk2_query(self, catalog_entry, state):
+        tap_stream_id = catalog_entry['tap_stream_id']
+        job_id = singer.get_bookmark(state, tap_stream_id, 'Bulk2JobID')
+        locator = singer.get_bookmark(state, tap_stream_id, 'Bulk2Locator')
+
+        if job_id and not self._job_exists(job_id):
+            LOGGER.info("Found stored Bulk 2.0 Job ID that no longer exists, starting a new job.")
+            job_id = None
+
+        if job_id:
+            LOGGER.info("Resuming Bulk 2.0 job %s from locator %s", job_id, locator)
+        else:
+            start_date = self.sf.get_start_date(state, catalog_entry)
+            job_id = self._create_job(catalog_entry, start_date)
+            locator = None
+
+            # Add the job to the state so it can be resumed if necessary
+            state = singer.write_bookmark(state, tap_stream_id, 'Bulk2JobID', job_id)
+            state = singer.write_bookmark(state, tap_stream_id, 'Bulk2Locator', locator)
+            write_state(state)
+
+        job = self._poll_on_job_status(job_id)
+
+        if job['state'] != 'JobComplete':
+            self._clear_job_state(state, tap_stream_id)
+            write_state(state)
+            raise TapSalesforceException(job.get('errorMessage') or
+                                         "Bulk 2.0 job {} {}".format(job_id, job['state']))
+
+        # The query has no ORDER BY so that Salesforce can chunk it, so the
+        # highest replication key seen only becomes the bookmark at the end
+        if singer.get_bookmark(state, tap_stream_id, 'JobHighestBookmarkSeen') is None:
+            state = singer.write_bookmark(state, tap_stream_id, 'JobHighestBookmarkSeen',
+                                          self.sf.get_start_date(state, catalog_entry))
+
+        while True:
+            resp = self._get_results(job_id, locator, catalog_entry)
+            with resp:
+                for rec in self.sf.merge_deferred_fields(catalog_entry, self.bulk._read_result_file(resp)):
+                    yield rec
+
+            locator = resp.headers.get('Sforce-Locator')
+            if not locator or locator == 'null':
+                break
+
+            state = singer.write_bookmark(state, tap_stream_id, 'Bulk2Locator', locator)
+            LOGGER.info("Finished syncing a page of Bulk 2.0 job %s, next locator: %s", job_id, locator)
+            write_state(state)
+
+        self._clear_job_state(state, tap_stream_id)
+
+    def _clear_job_state(self, state, tap_stream_id): # pylint: disable=no-self-use
+        for key in ('Bulk2JobID', 'Bulk2Locator', 'JobHighestBookmarkSeen'):
+            state.get('bookmarks', {}).get(tap_stream_id, {}).pop(key, None)
+
+    def _create_job(self, catalog_entry, start_date):
+        url = self.bulk2_url.format(self.sf.instance_url, "")
+
+        # Bulk API 2.0 can't split up a query with an ORDER BY clause
+        query = self.sf._build_query_string(catalog_entry, start_date, order_by_clause=False)
+        body = {"operation": "queryAll",
+                "query": query,
+                "contentType": "CSV",
+                "columnDelimiter": "COMMA",
+                "lineEnding": "LF"}
+
+        with metrics.http_request_timer("create_job") as timer:
+            timer.tags['sobject'] = catalog_entry['stream']
+            resp = self.sf._make_request(
+                'POST',
+                url,
+                headers=self.sf._get_report_query_headers(),
+                body=json.dumps(body))
+
+        return resp.json()['id']
+
+    def _get_job(self, job_id):
+        url = self.bulk2_url.format(self.sf.instance_url, "/{}".format(job_id))
+
+        with metrics.http_request_timer("get_job"):
+            resp = self.sf._make_request('GET', url, headers=self.sf._get_standard_headers())
+
+        return resp.json()
+
+    def _job_exists(self, job_id):
+        try:
+            self._get_job(job_id)
+            return True
+        except HTTPError as ex:
+            if ex.response is not None and ex.response.status_code == 404:
+                return False
+            raise
+
+    def _poll_on_job_status(self, job_id):
+        with PollingScheduler(JOB_STATUS_POLLING_MIN_SLEEP,
+                              JOB_STATUS_POLLING_SLEEP,
+                              {'job_id': job_id}) as scheduler:
+            job = self._get_job(job_id)
+            scheduler.observe([job])
+
+            while job['state'] not in ['JobComplete', 'Failed', 'Aborted']:
+                scheduler.wait()
+                job = self._get_job(job_id)
+                scheduler.observe([job])
+
+        return job
+
+    def _get_results(self, job_id, locator, catalog_entry):
+        url = self.bulk2_url.format(self.sf.instance_url, "/{}/results".format(job_id))
+        params = {"maxRecords": self.sf.bulk2_max_records}
+        if locator:
+            params['locator'] = locator
+
+        headers = self.sf._get_standard_headers()
+        headers['Accept'] = 'text/csv'
+
+        with metrics.http_request_timer("get_results") as timer:
+            timer.tags['sobject'] = catalog_entry['stream']
+            resp = self.sf._make_request('GET', url, headers=headers, stream=True, params=params)
+
+        return resp
@@ -0,0 +1,101 @@
+import email.utils
+import hashlib
+import json
+import os
+import tempfile
+import time
+
+import singer
+
+LOGGER = singer.get_logger()
+
+# Entries not revalidated for this many seconds are fetched again in full
+DEFAULT_MAX_AGE = 7 * 24 * 60 * 60
+# The least recently used entries are removed above this many bytes
+DEFAULT_MAX_BYTES = 100 * 1024 * 1024
+
+
+class DescribeCache():
+    """Keeps describe responses on disk, one file per org and describe URL,
+    which holds the API version and the object or report.
+
+    A cached describe is revalidated by sending its Last-Modified date as
+    If-Modified-Since, so an unchanged object costs a 304 response instead of
+    the whole describe. Each file's modification time is when it was last
+    fetched or revalidated; files older than max_age are ignored, and the
+    oldest files are removed while the cache is larger than max_bytes."""
+
+    def __init__(self, directory, max_age=None, max_bytes=None):
+        self.directory = directory
+        self.max_age = max_age if max_age is not None else DEFAULT_MAX_AGE
+        self.max_bytes = max_bytes if max_bytes is not None else DEFAULT_MAX_BYTES
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, org, url):
+        key = hashlib.sha256('{}\n{}'.format(org, url).encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, key + '.json')
+
+    def _read(self, path):
+        try:
+            if time.time() - os.path.getmtime(path) > self.max_age:
+                return None
+            with open(path, encoding='utf-8') as cache_file:
+                return json.load(cache_file)
+        except (OSError, ValueError):
+            return None
+
+    def _write(self, path, entry):
+        file_descriptor, temp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(file_descriptor, 'w', encoding='utf-8') as cache_file:
+                json.dump(entry, cache_file)
+            os.replace(temp_path, path)
+        except OSError:
+            LOGGER.warning("Could not write the describe cache file %s", path)
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    def _evict(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith('.json'):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.directory, name))
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, name))
+
+        now = time.time()
+        total_bytes = sum(size for _, size, _ in entries)
+        for mtime, size, name in sorted(entries):
+            if total_bytes <= self.max_bytes and now - mtime <= self.max_age:
+                continue
+            try:
+                os.remove(os.path.join(self.directory, name))
+                total_bytes -= size
+            except OSError:
+                pass
+
+    def get(self, org, url, headers, request):
+        """Returns the describe at url, given a function that makes the GET
+        request with the headers it is passed."""
+        path = self._path(org, url)
+        entry = self._read(path)
+
+        if entry is not None:
+            headers = dict(headers, **{'If-Modified-Since': entry['last_modified']})
+
+        resp = request(headers)
+
+        if resp.status_code == 304 and entry is not None:
+            LOGGER.info("Describe of %s is not modified, using the cached copy", url)
+            os.utime(path)
+            return entry['body']
+
+        body = resp.json()
+        last_modified = resp.headers.get('Last-Modified') or email.utils.formatdate(usegmt=True)
+        self._write(path, {'url': url, 'last_modified': last_modified, 'body': body})
+        self._evict()
+
+        return body
@@ -0,0 +1,102 @@
+import codecs
+import json
+
+# Consumed text is dropped from the buffer once there is this much of it
+BUFFER_TRIM_SIZE = 64 * 1024
+
+WHITESPACE = ' \t\n\r'
+
+
+class JsonArrayStream():
+    """Parses a JSON document from chunks of UTF-8 bytes, yielding the items
+    of the array at path one at a time as they arrive, so the whole array is
+    never held in memory at once.
+
+    Once the items are exhausted, document holds the rest of the document,
+    with an empty list in place of the array. Only the objects along the path
+    are parsed a token at a time, every other value is decoded whole."""
+
+    def __init__(self, chunks, path):
+        self.chunks = iter(chunks)
+        self.path = tuple(path)
+        self.decoder = codecs.getincrementaldecoder('utf-8')()
+        self.json_decoder = json.JSONDecoder()
+        self.buffer = ''
+        self.pos = 0
+        self.exhausted = False
+        self.document = None
+
+    def __iter__(self):
+        self.document = yield from self._parse(())
+
+    def _read(self):
+        """Adds the next chunk to the buffer, returning False at the end."""
+        if self.exhausted:
+            return False
+        if self.pos > BUFFER_TRIM_SIZE:
+            self.buffer = self.buffer[self.pos:]
+            self.pos = 0
+
+        chunk = next(self.chunks, None)
+        if chunk is None:
+            self.exhausted = True
+            self.buffer += self.decoder.decode(b'', final=True)
+        else:
+            self.buffer += self.decoder.decode(chunk)
+        return True
+
+    def _peek(self):
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self._read():
+                raise ValueError("Unexpected end of JSON document")
+
+    def _expect(self, chars):
+        char = self._peek()
+        if char not in chars:
+            raise ValueError("Expected one of {!r} at {!r}".format(chars, self.buffer[self.pos:self.pos + 20]))
+        self.pos += 1
+        return char
+
+    def _decode_value(self):
+        self._peek()
+        while True:
+            try:
+                value, end = self.json_decoder.raw_decode(self.buffer, self.pos)
+                # A number at the end of the buffer may go on in the next chunk
+                if end < len(self.buffer) or self.exhausted:
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.exhausted:
+                    raise
+            self._read()
+
+    def _parse(self, value_path):
+        if value_path == self.path and self._peek() == '[':
+            self._expect('[')
+            if self._peek() == ']':
+                self.pos += 1
+                return []
+            while True:
+                yield self._decode_value()
+                if self._expect(',]') == ']':
+                    return []
+
+        if value_path == self.path[:len(value_path)] and self._peek() == '{':
+            self._expect('{')
+            result = {}
+            if self._peek() == '}':
+                self.pos += 1
+                return result
+            while True:
+                key = self._decode_value()
+                self._expect(':')
+                result[key] = yield from self._parse(value_path + (key,))
+                if self._expect(',}') == '}':
+                    return result
+
+        return self._decode_value()
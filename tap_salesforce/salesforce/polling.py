@@ -0,0 +1,98 @@
+import time
+import singer
+from singer import metrics
+
+LOGGER = singer.get_logger()
+
+BACKOFF_FACTOR = 2
+
+
+class PollingScheduler():
+    """Decides how long to wait between status polls of a Bulk job.
+
+    Polls start at min_interval and back off exponentially up to
+    max_interval. Once some batches have completed, their record counts and
+    processing times are used to predict when the batches still in progress
+    will finish, and the next poll is scheduled for then instead.
+
+    Used as a context manager, it emits a timer metric for the time spent
+    waiting on the job and a counter metric for the number of polls made."""
+
+    def __init__(self, min_interval, max_interval, tags=None):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.tags = tags if tags else {}
+        self.interval = min_interval
+        self.polls = 0
+        self.start_time = time.time()
+        self.prediction = None
+        self.in_progress_since = {}
+        self.completed_batch_ids = set()
+        self.completed_seconds = []
+        self.completed_records = []
+
+    def __enter__(self):
+        self.start_time = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        tags = dict(self.tags)
+        tags[metrics.Tag.status] = metrics.Status.failed if exc_type else metrics.Status.succeeded
+        metrics.log(LOGGER, metrics.Point('timer', 'batch_status_wait', time.time() - self.start_time, tags))
+        metrics.log(LOGGER, metrics.Point('counter', 'batch_status_polls', self.polls, self.tags))
+
+    def observe(self, batches):
+        """Records the batchInfo of every batch returned by a status poll."""
+        now = time.time()
+        self.polls += 1
+
+        for batch in batches:
+            batch_id = batch['id']
+            if batch['state'] == 'InProgress':
+                self.in_progress_since.setdefault(batch_id, now)
+            elif batch['state'] == 'Completed' and batch_id not in self.completed_batch_ids:
+                self.completed_batch_ids.add(batch_id)
+                # totalProcessingTime is reported in milliseconds
+                seconds = int(batch.get('totalProcessingTime') or 0) / 1000
+                if seconds > 0:
+                    self.completed_seconds.append(seconds)
+                    self.completed_records.append(int(batch.get('numberRecordsProcessed') or 0))
+
+        self.prediction = self._predict_next_completion(batches, now)
+
+    def _predict_next_completion(self, batches, now):
+        """Returns the number of seconds until the first in progress batch is
+        expected to complete, or None if there is nothing to go on yet."""
+        if not self.completed_seconds:
+            return None
+
+        average_seconds = sum(self.completed_seconds) / len(self.completed_seconds)
+        average_records = sum(self.completed_records) / len(self.completed_records)
+        records_per_second = sum(self.completed_records) / sum(self.completed_seconds)
+
+        predictions = []
+        for batch in batches:
+            if batch['state'] != 'InProgress':
+                continue
+
+            processed = int(batch.get('numberRecordsProcessed') or 0)
+            if processed and records_per_second:
+                predictions.append((average_records - processed) / records_per_second)
+            else:
+                predictions.append(average_seconds - (now - self.in_progress_since[batch['id']]))
+
+        return min(predictions) if predictions else None
+
+    def next_interval(self):
+        """Returns the number of seconds to wait before the next poll."""
+        interval = self.interval
+        self.interval = min(self.interval * BACKOFF_FACTOR, self.max_interval)
+
+        # An overdue prediction is no better than backing off
+        if self.prediction is not None and self.prediction > 0:
+            interval = self.prediction
+
+        return max(self.min_interval, min(interval, self.max_interval))
+
+    def wait(self):
+        time.sleep(self.next_interval())
@@ -1,12 +1,94 @@
 # pylint: disable=protected-access
+import concurrent.futures
+import copy
+import datetime
+import hashlib
+import time
 import singer
 import json
 import singer.utils as singer_utils
+from singer import metadata
 from requests.exceptions import HTTPError
 from tap_salesforce.salesforce.exceptions import TapSalesforceException
+from tap_salesforce.salesforce.rest import id_to_int, int_to_id
+from tap_salesforce.salesforce.json_stream import JsonArrayStream
 
 LOGGER = singer.get_logger()
 
+# The most rows the synchronous Analytics API returns for a report run
+REPORT_ROW_LIMIT = 2000
+
+# Where a report run's detail rows are in its response, and the number of
+# bytes of the response parsed at a time
+REPORT_ROWS_PATH = ('factMap', 'T!T', 'rows')
+REPORT_RESPONSE_CHUNK_SIZE = 64 * 1024
+
+# Polls of an asynchronous report instance back off from the MIN_SLEEP up to
+# the SLEEP
+REPORT_INSTANCE_POLLING_MIN_SLEEP = 1
+REPORT_INSTANCE_POLLING_SLEEP = 30
+
+EPOCH = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+
+
+def _datetime_to_int(value):
+    return int((singer_utils.strptime_with_tz(value) - EPOCH).total_seconds())
+
+
+def _int_to_datetime(value):
+    return (EPOCH + datetime.timedelta(seconds=value)).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+# How the values of each type of column that reports can be sliced on are
+# turned into integers to split ranges of them, and back into filter values
+SLICE_COLUMN_TYPES = {
+    'date': (lambda value: datetime.date.fromisoformat(value[:10]).toordinal(),
+             lambda value: datetime.date.fromordinal(value).isoformat()),
+    'datetime': (_datetime_to_int, _int_to_datetime),
+    'id': (id_to_int, int_to_id),
+}
+
+
+def get_report_fingerprint(report_metadata, column_types):
+    return hashlib.sha256(json.dumps([report_metadata, column_types], sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def get_catalog_report_metadata(report):
+    """Returns the catalog metadata that lets a sync run a report without
+    describing it again: its reportMetadata, the data type of each detail
+    column and a fingerprint of the two."""
+    report_metadata = report['reportMetadata']
+    column_types = {column: info['dataType']
+                    for column, info in report['reportExtendedMetadata']['detailColumnInfo'].items()}
+
+    return {'report-metadata': report_metadata,
+            'report-column-types': column_types,
+            'report-metadata-fingerprint': get_report_fingerprint(report_metadata, column_types)}
+
+
+def get_row_transform(detail_columns, value_columns=()):
+    """Returns a function that turns a report row into a record of its
+    detail columns, taking each cell from the row in a single pass.
+    value_columns are taken from the cells' values instead of their labels,
+    which for dates are formatted for the user's locale."""
+    keys = ['value' if column in value_columns else 'label' for column in detail_columns]
+
+    def transform_row(row):
+        # If value is none, then the label sometimes is `-` , that's why we have to check for nulls by checking the value
+        # For some fileds, value can be a link to that object, so we can't actually use it, that's why we only use label.
+        # There will be more corner cases with other types of reports, that all should be handled here
+        return {column: cell[key] if cell['value'] is not None else ''
+                for column, key, cell in zip(detail_columns, keys, row['dataCells'])}
+
+    return transform_row
+
+
+def mark_truncated(state, catalog_entry):
+    """Marks in a report stream's state that some of its rows were left
+    out, so sync_report does not move its bookmark past them. The mark is
+    removed by sync_report before the state is written."""
+    singer.write_bookmark(state, catalog_entry['tap_stream_id'], 'ReportTruncated', True)
+
 
 class ReportRest():
 
@@ -23,28 +105,121 @@ class ReportRest():
         #  4- Report data that is returned is a bit different than normal object data (they have links, etc..)
         #     We'll do an intial transform so that we can pass the rows to the singer for transformation
 
+        # The report details are kept in the catalog at discovery, so they
+        # only have to be described again for catalogs from before that
+        catalog_metadata = metadata.to_map(catalog_entry['metadata'])
+        replication_key = catalog_metadata.get((), {}).get('replication-key')
+        start_date = replication_key and self.sf.get_start_date(state, catalog_entry)
+
+        report = self._get_catalog_report(catalog_entry)
+        if report is not None:
+            return self._get_report_data(report, catalog_entry, state, replication_key, start_date, from_catalog=True)
+
         # Getting the report Id from the config (should be the same as the catalog entry)
         report = self.sf.describe()
 
-        return self._get_report_data(report, catalog_entry)
+        return self._get_report_data(report, catalog_entry, state, replication_key, start_date)
+
+    # pylint: disable=no-self-use
+    def _get_catalog_report(self, catalog_entry):
+        """Returns the report details kept in the catalog entry's metadata,
+        shaped like a describe, or None if there are none or they don't match
+        their fingerprint."""
+        catalog_metadata = metadata.to_map(catalog_entry['metadata']).get((), {})
+        report_metadata = catalog_metadata.get('report-metadata')
+        column_types = catalog_metadata.get('report-column-types')
+        if report_metadata is None or column_types is None:
+            return None
+
+        if get_report_fingerprint(report_metadata, column_types) != catalog_metadata.get('report-metadata-fingerprint'):
+            LOGGER.info("The report metadata in the catalog does not match its fingerprint, describing report %s",
+                        catalog_entry['stream'])
+            return None
 
+        return {'reportMetadata': report_metadata,
+                'reportExtendedMetadata': {'detailColumnInfo': {column: {'dataType': data_type}
+                                                                for column, data_type in column_types.items()}}}
+
+    # pylint: disable=too-many-arguments
     def _get_report_data(
             self,
             report_metadata,
-            catalog_entry):
-        body = {"reportMetadata": report_metadata['reportMetadata']}
+            catalog_entry,
+            state,
+            replication_key=None,
+            start_date=None,
+            from_catalog=False):
+        if replication_key:
+            report_metadata = self._filter_from_start_date(report_metadata, replication_key, start_date)
+        transform_row = get_row_transform(report_metadata['reportMetadata']['detailColumns'],
+                                          (replication_key,))
+        try:
+            report_results, resp_json = self._run_report(
+                report_metadata['reportMetadata'], catalog_entry, transform_row)
+        except HTTPError as ex:
+            # The report may have changed since it was discovered
+            response = ex.response.json()
+            if not from_catalog or ex.response.status_code != 400 or \
+               (isinstance(response, list) and response[0].get("errorCode") == "QUERY_TIMEOUT"):
+                raise
+            LOGGER.warning("Report %s rejected the report metadata in the catalog, describing it again",
+                           catalog_entry['stream'])
+            report_metadata = self.sf.describe()
+            if replication_key:
+                report_metadata = self._filter_from_start_date(report_metadata, replication_key, start_date)
+            transform_row = get_row_transform(report_metadata['reportMetadata']['detailColumns'],
+                                              (replication_key,))
+            report_results, resp_json = self._run_report(
+                report_metadata['reportMetadata'], catalog_entry, transform_row)
+
+        if resp_json.get('allData') is False:
+            if self.sf.report_slice_column:
+                yield from self._get_sliced_rows(report_metadata, catalog_entry, state, transform_row)
+                return
+            LOGGER.warning("Report %s returned only its first %d rows, set report_slice_column "
+                           "to sync all of them", catalog_entry['stream'], len(report_results))
+            mark_truncated(state, catalog_entry)
+
+        yield from report_results
+
+    def _filter_from_start_date(self, report, replication_key, start_date):
+        """Returns a copy of a report's details whose reportMetadata only
+        selects the rows with a replication_key from start_date on."""
+        column_info = report['reportExtendedMetadata']['detailColumnInfo'].get(replication_key)
+        if replication_key not in report['reportMetadata']['detailColumns'] or column_info is None:
+            raise TapSalesforceException(
+                "replication-key {} is not a column of the report".format(replication_key))
+        if column_info['dataType'] not in ('date', 'datetime'):
+            raise TapSalesforceException(
+                "replication-key {} is a {} column, only date and datetime columns "
+                "can be replicated incrementally".format(replication_key, column_info['dataType']))
+
+        start = singer_utils.strptime_with_tz(start_date).astimezone(datetime.timezone.utc)
+        if column_info['dataType'] == 'date':
+            value = start.date().isoformat()
+        else:
+            value = start.strftime("%Y-%m-%dT%H:%M:%SZ")
+        LOGGER.info("Running report %s for %s from %s", self.sf.report_id, replication_key, value)
+
+        report_filter = {"column": replication_key, "operator": "greaterOrEqual", "value": value}
+        return dict(report, reportMetadata=self._add_filters(report['reportMetadata'], [report_filter]))
+
+    def _run_report(self, report_metadata, catalog_entry, transform_row):
+        """Runs the report and returns its rows, each passed through
+        transform_row as it is parsed off the response, along with the rest
+        of the response."""
+        if self.sf.report_async:
+            return self._run_report_instance(report_metadata, catalog_entry, transform_row)
+
+        body = {"reportMetadata": report_metadata}
         url = f'{self.sf.instance_url}/services/data/v48.0/analytics/reports/query'
 
         headers = self.sf._get_report_query_headers()
 
-        sync_start = singer_utils.now()
-
         try:
             resp = self.sf._make_request(
-                'POST', url, headers=headers, body=json.dumps(body))
-            resp_json = resp.json()
-            report_results = resp_json.get('factMap').get("T!T").get('rows')
-            return self.__transform_report_api_result(report_results, report_metadata['reportMetadata']['detailColumns'])
+                'POST', url, headers=headers, body=json.dumps(body), stream=True)
+            return self._read_report_response(resp, transform_row)
 
         except HTTPError as ex:
             response = ex.response.json()
@@ -54,21 +229,136 @@ class ReportRest():
                     catalog_entry['stream'])
             raise ex
 
-    def __transform_report_api_result(self, report_results, detail_columns):
-        # Transform and cleanup results
-        results = []
-        for row in report_results:
-            data_cell = row['dataCells']
-            tmp_row = {}
-            for i in range(0, len(row['dataCells'])):
-                # If value is none, then the label sometimes is `-` , that's why we have to check for nulls by checking the value
-                # For some fileds, value can be a link to that object, so we can't actually use it, that's why we only use label.
-                # There will be more corner cases with other types of reports, that all should be handled here
-                if data_cell[i]['value'] != None:
-                    tmp_row[detail_columns[i]] = data_cell[i]['label']
-                else:
-                    tmp_row[detail_columns[i]] = ''
-
-            results.append(tmp_row)
-
-        return results
+    # pylint: disable=no-self-use
+    def _read_report_response(self, resp, transform_row):
+        """Parses the rows of a report response one at a time, so neither
+        the raw response nor its rows are ever held in memory whole."""
+        with resp:
+            rows = JsonArrayStream(resp.iter_content(REPORT_RESPONSE_CHUNK_SIZE), REPORT_ROWS_PATH)
+            report_results = [transform_row(row) for row in rows]
+
+        return report_results, rows.document
+
+    def _run_report_instance(self, report_metadata, catalog_entry, transform_row):
+        """Runs the report asynchronously, as an instance that is polled
+        until it has finished, and returns its results. Unlike the query
+        resource no connection is held open while the report runs."""
+        body = {"reportMetadata": report_metadata}
+        url = f'{self.sf.instance_url}/services/data/v48.0/analytics/reports/{self.sf.report_id}/instances'
+
+        resp = self.sf._make_request(
+            'POST', url, headers=self.sf._get_report_query_headers(), body=json.dumps(body))
+        instance_id = resp.json()['id']
+        instance_url = f'{url}/{instance_id}'
+        LOGGER.info("Started instance %s of report %s", instance_id, catalog_entry['stream'])
+
+        sleep = REPORT_INSTANCE_POLLING_MIN_SLEEP
+        while True:
+            resp = self.sf._make_request(
+                'GET', instance_url, headers=self.sf._get_standard_headers(), stream=True)
+            report_results, resp_json = self._read_report_response(resp, transform_row)
+            attributes = resp_json['attributes']
+
+            if attributes['status'] == 'Success':
+                return report_results, resp_json
+            if attributes['status'] == 'Error':
+                raise TapSalesforceException("Instance {} of report {} failed: {}".format(
+                    instance_id, catalog_entry['stream'], attributes.get('errorMessage')))
+
+            time.sleep(sleep)
+            sleep = min(sleep * 2, REPORT_INSTANCE_POLLING_SLEEP)
+
+    def _get_sliced_rows(self, report, catalog_entry, state, transform_row):
+        """Returns all the rows of a report that has more than
+        REPORT_ROW_LIMIT of them, by running it in slices of the range of
+        report_slice_column's values. The slices are run
+        report_slice_concurrency at a time, and any slice that still has too
+        many rows is split in half and run again. Rows are returned slice by
+        slice, in the order of the column, starting with the rows that have
+        no value for it."""
+        report_metadata = report['reportMetadata']
+        column = self.sf.report_slice_column
+        column_info = report['reportExtendedMetadata']['detailColumnInfo'].get(column)
+        if column not in report_metadata['detailColumns'] or column_info is None:
+            raise TapSalesforceException(
+                "report_slice_column {} is not a column of the report".format(column))
+        if column_info['dataType'] not in SLICE_COLUMN_TYPES:
+            raise TapSalesforceException(
+                "report_slice_column {} is a {} column, only date, datetime and id columns "
+                "can be sliced on".format(column, column_info['dataType']))
+        to_int, from_int = SLICE_COLUMN_TYPES[column_info['dataType']]
+
+        first_value = self._get_first_value(report_metadata, catalog_entry, column, 'Asc')
+        last_value = self._get_first_value(report_metadata, catalog_entry, column, 'Desc')
+        low, high = to_int(first_value), to_int(last_value) + 1
+        width = max(1, -(-(high - low) // self.sf.report_slice_concurrency))
+        LOGGER.info("Running report %s in slices of %s from %s to %s",
+                    catalog_entry['stream'], column, first_value, last_value)
+
+        def filters(bounds):
+            if bounds is None:
+                return [{"column": column, "operator": "equals", "value": ""}]
+            return [{"column": column, "operator": "greaterOrEqual", "value": from_int(bounds[0])},
+                    {"column": column, "operator": "lessThan", "value": from_int(bounds[1])}]
+
+        def run_slice(bounds):
+            return self._run_report(self._add_filters(report_metadata, filters(bounds)),
+                                    catalog_entry,
+                                    transform_row)
+
+        # The rows with no value for the column fall outside every range
+        slices = [None] + [(start, min(start + width, high)) for start in range(low, high, width)]
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.sf.report_slice_concurrency) as executor:
+            futures = [executor.submit(run_slice, bounds) for bounds in slices]
+            index = 0
+            while index < len(slices):
+                report_results, resp_json = futures[index].result()
+                bounds = slices[index]
+                if resp_json.get('allData') is False:
+                    if bounds is not None and bounds[1] - bounds[0] > 1:
+                        middle = (bounds[0] + bounds[1]) // 2
+                        halves = [(bounds[0], middle), (middle, bounds[1])]
+                        slices[index:index + 1] = halves
+                        futures[index:index + 1] = [executor.submit(run_slice, half) for half in halves]
+                        continue
+                    LOGGER.warning("A slice of report %s with %s %s has more than %d rows, "
+                                   "only the first of them are synced",
+                                   catalog_entry['stream'], column,
+                                   from_int(bounds[0]) if bounds else "empty",
+                                   REPORT_ROW_LIMIT)
+                    mark_truncated(state, catalog_entry)
+                yield from report_results
+                index += 1
+
+    def _get_first_value(self, report_metadata, catalog_entry, column, sort_order):
+        """Returns the first value of a column in the given order, by running
+        the report sorted on it for one row."""
+        report_metadata = self._add_filters(
+            report_metadata, [{"column": column, "operator": "notEqual", "value": ""}])
+        report_metadata['sortBy'] = [{"sortColumn": column, "sortOrder": sort_order}]
+        report_metadata['topRows'] = {"rowLimit": 1, "direction": sort_order}
+
+        column_index = report_metadata['detailColumns'].index(column)
+        values, _ = self._run_report(report_metadata,
+                                     catalog_entry,
+                                     lambda row: row['dataCells'][column_index]['value'])
+
+        if not values:
+            raise TapSalesforceException(
+                "report_slice_column {} has no values to slice the report on".format(column))
+        return values[0]
+
+    # pylint: disable=no-self-use
+    def _add_filters(self, report_metadata, filters):
+        """Returns a copy of report_metadata with filters ANDed to its own."""
+        report_metadata = copy.deepcopy(report_metadata)
+        report_filters = report_metadata.get('reportFilters') or []
+        boolean_filter = report_metadata.get('reportBooleanFilter')
+        if boolean_filter:
+            report_metadata['reportBooleanFilter'] = "({}) AND {}".format(
+                boolean_filter,
+                " AND ".join(str(len(report_filters) + i + 1) for i in range(len(filters))))
+        report_metadata['reportFilters'] = report_filters + filters
+
+        return report_metadata
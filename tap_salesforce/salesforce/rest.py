@@ -1,13 +1,179 @@
 # pylint: disable=protected-access
+import collections
+import datetime
+import functools
+import queue
+import threading
+import time
 import singer
 import singer.utils as singer_utils
+from singer import metadata
 from requests.exceptions import HTTPError
 from tap_salesforce.salesforce.exceptions import TapSalesforceException
+from tap_salesforce.output import write_state
 
 LOGGER = singer.get_logger()
 
 MAX_RETRIES = 4
 
+# Seconds between checks of whether the consumer of prefetched pages stopped
+PREFETCH_PUT_TIMEOUT = 1
+
+# Learned query windows aim for this many seconds before the first page
+# arrives, well inside the two minutes after which QUERY_TIMEOUT is raised
+TARGET_QUERY_SECONDS = 30
+QUERY_WINDOW_GROWTH = 2
+MIN_QUERY_WINDOW_SECONDS = 60
+QUERY_WINDOW_SEARCH_MARGIN = 0.1
+
+# Salesforce Ids are base 62 numbers, case sensitive in their 15 character
+# form, and are ordered the same as these characters are
+ID_ALPHABET = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz'
+ID_LENGTH = 15
+
+# Number of records of each query window or Id slice read ahead of the consumer
+WINDOW_READ_AHEAD_RECORDS = 2000
+
+
+def id_to_int(sf_id):
+    value = 0
+    for char in sf_id[:ID_LENGTH]:
+        value = value * len(ID_ALPHABET) + ID_ALPHABET.index(char)
+    return value
+
+
+def int_to_id(value):
+    chars = []
+    for _ in range(ID_LENGTH):
+        value, digit = divmod(value, len(ID_ALPHABET))
+        chars.append(ID_ALPHABET[digit])
+    return ''.join(reversed(chars))
+
+
+class ReadAhead():
+    """Reads up to depth items of an iterator ahead of its consumer on a
+    background thread, which starts straight away. Exceptions raised by the
+    iterator are re-raised to the consumer. close() stops the thread."""
+
+    def __init__(self, items, depth):
+        self.items = queue.Queue(maxsize=depth)
+        self.stopped = threading.Event()
+        self.reader = threading.Thread(target=self._read, args=(items,), daemon=True)
+        self.reader.start()
+
+    def _put(self, item):
+        while not self.stopped.is_set():
+            try:
+                self.items.put(item, timeout=PREFETCH_PUT_TIMEOUT)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _read(self, items):
+        try:
+            for item in items:
+                if not self._put((item, None)):
+                    return
+            self._put((ReadAhead, None))
+        except BaseException as ex: # pylint: disable=broad-except
+            self._put((None, ex))
+        finally:
+            # Stop anything reading ahead on behalf of the iterator too
+            close = getattr(items, 'close', None)
+            if close:
+                close()
+
+    def __iter__(self):
+        try:
+            while True:
+                item, ex = self.items.get()
+                if ex is not None:
+                    raise ex
+                if item is ReadAhead:
+                    break
+                yield item
+        finally:
+            self.close()
+
+    def close(self):
+        self.stopped.set()
+        self.reader.join()
+
+
+class QueryWindowSizer():
+    """Learns how large a window of the replication key a stream's REST
+    query can cover without a QUERY_TIMEOUT, and keeps it in state.
+
+    QueryWindowSucceeded and QueryWindowFailed hold the largest window that
+    succeeded and the smallest window that timed out, in seconds. Until a
+    window has timed out the whole range is queried at once, as before.
+    After that, each window is sized from the one before it, scaling the time
+    its query took to return the first page towards TARGET_QUERY_SECONDS,
+    without reaching the window that failed. The rows of each window are
+    logged alongside."""
+
+    def __init__(self, state, tap_stream_id):
+        self.state = state
+        self.tap_stream_id = tap_stream_id
+        self.succeeded = singer.get_bookmark(state, tap_stream_id, 'QueryWindowSucceeded')
+        self.failed = singer.get_bookmark(state, tap_stream_id, 'QueryWindowFailed')
+
+        if self.failed is None:
+            self.window = None
+        elif self.succeeded is not None and self.succeeded < self.failed:
+            self.window = self.succeeded
+        else:
+            self.window = self.failed // 2
+
+    def next_window(self):
+        """Returns the size of the next window to query, or None to query
+        the rest of the range at once."""
+        if self.window is None:
+            return None
+        return datetime.timedelta(seconds=max(MIN_QUERY_WINDOW_SECONDS, self.window))
+
+    def observe_success(self, window, seconds, rows):
+        window = int(window.total_seconds())
+        LOGGER.info("Queried a %ds window of %s in %.1fs, %d rows",
+                    window, self.tap_stream_id, seconds, rows)
+
+        if self.succeeded is None or window > self.succeeded:
+            self.succeeded = window
+            self._write_bookmark('QueryWindowSucceeded', window)
+        if self.failed is not None and window >= self.failed:
+            # Whatever made the failed window time out has gone away
+            self.failed = None
+            self._write_bookmark('QueryWindowFailed', None)
+
+        if self.window is None:
+            return
+
+        scale = TARGET_QUERY_SECONDS / seconds if seconds else QUERY_WINDOW_GROWTH
+        scale = max(1 / QUERY_WINDOW_GROWTH, min(scale, QUERY_WINDOW_GROWTH))
+        next_window = int(window * scale)
+
+        if self.failed is not None:
+            if self.failed - self.succeeded <= self.failed * QUERY_WINDOW_SEARCH_MARGIN:
+                # Close enough, stick with the largest window that worked
+                next_window = min(next_window, self.succeeded)
+            else:
+                # Search between the largest window that worked and the
+                # smallest one that didn't
+                next_window = min(next_window, (self.succeeded + self.failed) // 2)
+        self.window = next_window
+
+    def observe_timeout(self, window):
+        window = int(window.total_seconds())
+        if self.failed is None or window < self.failed:
+            self.failed = window
+            self._write_bookmark('QueryWindowFailed', window)
+        self.window = window // 2
+
+    def _write_bookmark(self, key, value):
+        self.state = singer.write_bookmark(self.state, self.tap_stream_id, key, value)
+
+
 class Rest():
 
     def __init__(self, sf):
@@ -15,9 +181,216 @@ class Rest():
 
     def query(self, catalog_entry, state):
         start_date = self.sf.get_start_date(state, catalog_entry)
-        query = self.sf._build_query_string(catalog_entry, start_date)
+        catalog_metadata = metadata.to_map(catalog_entry['metadata'])
+        replication_key = catalog_metadata.get((), {}).get('replication-key')
+
+        if replication_key and self.sf.rest_query_windows > 1:
+            records = self._query_windows(catalog_entry, start_date)
+        elif not replication_key and self.sf.rest_id_chunks > 1:
+            records = self._query_id_slices(catalog_entry, state)
+        elif replication_key:
+            sizer = QueryWindowSizer(state, catalog_entry['tap_stream_id'])
+            end_date = self._get_window_end(singer_utils.strptime_with_tz(start_date), sizer)
+            query = self.sf._build_query_string(catalog_entry,
+                                                start_date,
+                                                end_date and singer_utils.strftime(end_date))
+            records = self._query_recur(query, catalog_entry, start_date, end_date, sizer=sizer)
+        else:
+            query = self.sf._build_query_string(catalog_entry, start_date)
+            records = self._query_recur(query, catalog_entry, start_date)
+
+        return self.sf.merge_deferred_fields(catalog_entry, records)
+
+    # pylint: disable=no-self-use
+    def _get_window_end(self, start_date, sizer, window_end=None):
+        """Returns the end of the next learned window from start_date, or
+        None if it would reach past window_end or now."""
+        window = sizer and sizer.next_window()
+        if window is None:
+            return None
+
+        end_date = (start_date + window).replace(microsecond=0)
+        if end_date >= (window_end or singer_utils.now()):
+            return None
+        return end_date
+
+    def _get_query_windows(self, start_date_str):
+        """Splits [start_date, now) into rest_query_windows windows of the
+        replication key. The last window is left open ended."""
+        start_date = singer_utils.strptime_with_tz(start_date_str)
+        window_size = (singer_utils.now() - start_date) / self.sf.rest_query_windows
+
+        if window_size <= datetime.timedelta(0):
+            return [(start_date, None)]
+
+        windows = []
+        window_start = start_date
+        for i in range(1, self.sf.rest_query_windows):
+            window_end = (start_date + window_size * i).replace(microsecond=0)
+            windows.append((window_start, window_end))
+            window_start = window_end
+        windows.append((window_start, None))
+
+        return windows
+
+    def _query_window(self, catalog_entry, window_start, window_end):
+        window_start_str = singer_utils.strftime(window_start)
+        query = self.sf._build_query_string(catalog_entry,
+                                            window_start_str,
+                                            window_end and singer_utils.strftime(window_end))
+
+        return self._query_recur(query, catalog_entry, window_start_str, window_end, window_end=window_end)
 
-        return self._query_recur(query, catalog_entry, start_date)
+    def _query_windows(self, catalog_entry, start_date_str):
+        """Queries the windows of the replication key from
+        _get_query_windows, up to rest_window_concurrency of them at once.
+        Records are yielded a window at a time, in order, so the bookmark only
+        ever moves through the windows that have been completely synced."""
+        windows = self._get_query_windows(start_date_str)
+        LOGGER.info("Querying %s in %d replication key windows, %d at a time",
+                    catalog_entry['stream'],
+                    len(windows),
+                    self.sf.rest_window_concurrency)
+
+        queries = [functools.partial(self._query_window, catalog_entry, window_start, window_end)
+                   for window_start, window_end in windows]
+        for records in self._read_in_order(queries):
+            yield from records
+
+    def _read_in_order(self, queries):
+        """Given a list of functions that each start a query, yields an
+        iterator of each query's records in order while up to
+        rest_window_concurrency of the queries are read at once. Each
+        iterator must be exhausted before the next one is requested."""
+        queries = collections.deque(queries)
+        readers = collections.deque()
+
+        def start_readers():
+            while queries and len(readers) < self.sf.rest_window_concurrency:
+                readers.append(ReadAhead(queries.popleft()(), WINDOW_READ_AHEAD_RECORDS))
+
+        try:
+            start_readers()
+            while readers:
+                yield readers[0]
+                readers.popleft().close()
+                start_readers()
+        finally:
+            for reader in readers:
+                reader.close()
+
+    def _query_id_slices(self, catalog_entry, state):
+        """Queries a full table in rest_id_chunks slices of Id, up to
+        rest_window_concurrency of them at once. The slice boundaries and the
+        number of slices synced so far are kept in state, so an interrupted
+        sync resumes from the first slice it had not finished."""
+        tap_stream_id = catalog_entry['tap_stream_id']
+        boundaries = singer.get_bookmark(state, tap_stream_id, 'RestIdBoundaries')
+        slices_synced = singer.get_bookmark(state, tap_stream_id, 'RestIdSlicesSynced') or 0
+
+        if boundaries is None:
+            boundaries = self._get_id_boundaries(catalog_entry)
+            slices_synced = 0
+            state = singer.write_bookmark(state, tap_stream_id, 'RestIdBoundaries', boundaries)
+            state = singer.write_bookmark(state, tap_stream_id, 'RestIdSlicesSynced', slices_synced)
+            write_state(state)
+        else:
+            LOGGER.info("Resuming the Id slices of %s after %d of %d",
+                        catalog_entry['stream'], slices_synced, len(boundaries) + 1)
+
+        slice_ids = [None] + boundaries + [None]
+        queries = [functools.partial(self._query_id_slice, catalog_entry, slice_ids[i], slice_ids[i + 1])
+                   for i in range(slices_synced, len(slice_ids) - 1)]
+
+        for records in self._read_in_order(queries):
+            yield from records
+
+            slices_synced += 1
+            state = singer.write_bookmark(state, tap_stream_id, 'RestIdSlicesSynced', slices_synced)
+            LOGGER.info("Finished syncing Id slice %d of %d of %s",
+                        slices_synced, len(slice_ids) - 1, catalog_entry['stream'])
+            write_state(state)
+
+        for key in ('RestIdBoundaries', 'RestIdSlicesSynced'):
+            state.get('bookmarks', {}).get(tap_stream_id, {}).pop(key, None)
+
+    def _query_id_slice(self, catalog_entry, first_id, end_id):
+        """Yields the records with an Id from first_id up to, but not
+        including, end_id. Either end may be None to leave it open."""
+        query = self.sf._build_query_string(catalog_entry, None)
+        conditions = []
+        if first_id:
+            conditions.append("Id >= '{}'".format(first_id))
+        if end_id:
+            conditions.append("Id < '{}'".format(end_id))
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+
+        params = {"q": query}
+        url = "{}/services/data/v41.0/queryAll".format(self.sf.instance_url)
+
+        return self._sync_records(url, self._get_query_headers(), params)
+
+    def _get_id_boundaries(self, catalog_entry):
+        """Returns the first Id of every slice but the first, by sampling
+        the Ids with ORDER BY Id LIMIT 1 queries. The widest range of Ids is
+        split at its midpoint until there are rest_id_chunks ranges, and each
+        half is narrowed to the Ids that really exist, so gaps in the Id
+        space don't end up as empty slices."""
+        first_id = self._sample_id(catalog_entry, 'ASC')
+        if first_id is None:
+            return []
+        ranges = [(first_id, self._sample_id(catalog_entry, 'DESC'))]
+
+        while len(ranges) < self.sf.rest_id_chunks:
+            index = max(range(len(ranges)),
+                        key=lambda i: id_to_int(ranges[i][1]) - id_to_int(ranges[i][0]))
+            range_first, range_last = ranges[index]
+            if id_to_int(range_last) - id_to_int(range_first) < 2:
+                break
+
+            middle = int_to_id((id_to_int(range_first) + id_to_int(range_last)) // 2)
+            ranges[index:index + 1] = [
+                (range_first, self._sample_id(catalog_entry, 'DESC', range_first, middle)),
+                (self._sample_id(catalog_entry, 'ASC', middle, range_last, inclusive=True), range_last)]
+
+        LOGGER.info("Split %s into %d Id slices", catalog_entry['stream'], len(ranges))
+        return [range_first for range_first, _ in ranges[1:]]
+
+    # pylint: disable=too-many-arguments
+    def _sample_id(self, catalog_entry, order, first_id=None, end_id=None, inclusive=False):
+        """Returns the first Id in the given order from first_id up to end_id,
+        or None if there are none."""
+        conditions = []
+        if first_id:
+            conditions.append("Id >= '{}'".format(first_id))
+        if end_id:
+            conditions.append("Id {} '{}'".format('<=' if inclusive else '<', end_id))
+
+        query = "SELECT Id FROM {}".format(catalog_entry['stream'])
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        query += " ORDER BY Id {} LIMIT 1".format(order)
+
+        params = {"q": query}
+        url = "{}/services/data/v41.0/queryAll".format(self.sf.instance_url)
+        resp = self.sf._make_request('GET', url, headers=self._get_query_headers(), params=params)
+        records = resp.json().get('records')
+
+        return records[0]['Id'] if records else None
+
+    def query_by_ids(self, catalog_entry, fields, ids):
+        """Yields the given fields of the records with the given Ids, including
+        deleted ones, in no particular order."""
+        query = "SELECT Id,{} FROM {} WHERE Id IN ({})".format(
+            ",".join(fields),
+            catalog_entry['stream'],
+            ",".join("'{}'".format(record_id) for record_id in ids))
+        params = {"q": query}
+        url = "{}/services/data/v41.0/queryAll".format(self.sf.instance_url)
+        headers = self._get_query_headers()
+
+        return self._sync_records(url, headers, params)
 
     # pylint: disable=too-many-arguments
     def _query_recur(
@@ -26,12 +399,17 @@ class Rest():
             catalog_entry,
             start_date_str,
             end_date=None,
-            retries=MAX_RETRIES):
+            retries=MAX_RETRIES,
+            window_end=None,
+            sizer=None):
+        """Queries from start_date_str to window_end, or to now. When an
+        end_date before then is given, the query is expected to stop there and
+        the rest of the range is queried afterwards."""
         params = {"q": query}
         url = "{}/services/data/v41.0/queryAll".format(self.sf.instance_url)
-        headers = self.sf._get_standard_headers()
+        headers = self._get_query_headers()
 
-        sync_start = singer_utils.now()
+        sync_start = window_end or singer_utils.now()
         if end_date is None:
             end_date = sync_start
 
@@ -42,19 +420,38 @@ class Rest():
 
         retryable = False
         try:
+            query_start = time.time()
+            query_seconds = None
+            rows = 0
             for rec in self._sync_records(url, headers, params):
+                if query_seconds is None:
+                    query_seconds = time.time() - query_start
+                rows += 1
                 yield rec
 
+            if sizer:
+                start_date = singer_utils.strptime_with_tz(start_date_str)
+                sizer.observe_success(end_date - start_date,
+                                      query_seconds if query_seconds is not None else time.time() - query_start,
+                                      rows)
+
             # If the date range was chunked (an end_date was passed), sync
-            # from the end_date -> now
+            # from the end_date -> now, or the end of the window
             if end_date < sync_start:
                 next_start_date_str = singer_utils.strftime(end_date)
-                query = self.sf._build_query_string(catalog_entry, next_start_date_str)
+                next_end_date = self._get_window_end(end_date, sizer, window_end) or window_end
+                query = self.sf._build_query_string(catalog_entry,
+                                                    next_start_date_str,
+                                                    next_end_date and singer_utils.strftime(next_end_date))
                 for record in self._query_recur(
                         query,
                         catalog_entry,
                         next_start_date_str,
-                        retries=retries):
+                        next_end_date,
+                        # Retries count the timeouts since the last query that succeeded
+                        retries=MAX_RETRIES,
+                        window_end=window_end,
+                        sizer=sizer):
                     yield record
 
         except HTTPError as ex:
@@ -66,6 +463,8 @@ class Rest():
                     "Salesforce returned QUERY_TIMEOUT querying %d days of %s",
                     day_range,
                     catalog_entry['stream'])
+                if sizer:
+                    sizer.observe_timeout(end_date - start_date)
                 retryable = True
             else:
                 raise ex
@@ -86,16 +485,34 @@ class Rest():
                     catalog_entry,
                     start_date_str,
                     end_date,
-                    retries - 1):
+                    retries - 1,
+                    window_end=window_end,
+                    sizer=sizer):
                 yield record
 
+    def _get_query_headers(self):
+        headers = self.sf._get_standard_headers()
+        if self.sf.rest_batch_size:
+            headers['Sforce-Query-Options'] = 'batchSize={}'.format(self.sf.rest_batch_size)
+
+        return headers
+
     def _sync_records(self, url, headers, params):
+        if not self.sf.rest_prefetch_pages:
+            for records in self._iter_pages(url, headers, params):
+                yield from records
+            return
+
+        # Request the next pages while the current one is being synced
+        for records in ReadAhead(self._iter_pages(url, headers, params), self.sf.rest_prefetch_pages):
+            yield from records
+
+    def _iter_pages(self, url, headers, params):
         while True:
             resp = self.sf._make_request('GET', url, headers=headers, params=params)
             resp_json = resp.json()
 
-            for rec in resp_json.get('records'):
-                yield rec
+            yield resp_json.get('records')
 
             next_records_url = resp_json.get('nextRecordsUrl')
 
@@ -0,0 +1,75 @@
+import collections
+import threading
+
+
+class ResultFileBuffer():
+    """Passes a Bulk result file from the download worker writing it to the
+    record parser reading it, in memory. Once max_memory bytes are unread,
+    writes wait for the parser to catch up, so the download never gets more
+    than that ahead of the parser.
+
+    Reads block until there is data, and return b'' once the whole file has
+    been read. An error the writer finishes with is raised by the read after
+    the data written before it."""
+
+    def __init__(self, max_memory):
+        self.max_memory = max_memory
+        self.condition = threading.Condition()
+        self.chunks = collections.deque()
+        self.memory = 0
+        self.finished = False
+        self.error = None
+        self.closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def write(self, chunk):
+        """Adds a chunk of the file, waiting while the buffer is full. Returns
+        False if the buffer has been closed and the download should stop."""
+        with self.condition:
+            while self.memory >= self.max_memory and not self.closed:
+                self.condition.wait()
+            if self.closed:
+                return False
+
+            self.chunks.append(chunk)
+            self.memory += len(chunk)
+            self.condition.notify_all()
+            return True
+
+    def finish(self, error=None):
+        """Marks the end of the file, or the error the download failed with."""
+        with self.condition:
+            self.finished = True
+            self.error = error
+            self.condition.notify_all()
+
+    def read(self, size):
+        with self.condition:
+            while True:
+                if self.chunks:
+                    chunk = self.chunks.popleft()
+                    if len(chunk) > size:
+                        self.chunks.appendleft(chunk[size:])
+                        chunk = chunk[:size]
+                    self.memory -= len(chunk)
+                    self.condition.notify_all()
+                    return chunk
+
+                if self.error is not None:
+                    raise self.error
+                if self.finished or self.closed:
+                    return b''
+                self.condition.wait()
+
+    def close(self):
+        """Discards the buffer, which stops its download at the next chunk."""
+        with self.condition:
+            self.closed = True
+            self.chunks.clear()
+            self.memory = 0
+            self.condition.notify_all()
@@ -0,0 +1,60 @@
+import hashlib
+import json
+import os
+import tempfile
+import time
+
+import singer
+
+LOGGER = singer.get_logger()
+
+# Salesforce's default session timeout. A cached token that has timed out
+# sooner costs one rejected request and a refresh
+DEFAULT_MAX_AGE = 2 * 60 * 60
+
+
+class TokenCache():
+    """Keeps OAuth2 access tokens on disk, one file per login URL, client and
+    refresh token, so runs started shortly after each other can skip the
+    login. Tokens are kept for max_age seconds after they were issued.
+
+    The files hold live credentials and are only readable by their owner."""
+
+    def __init__(self, directory, max_age=None):
+        self.directory = directory
+        self.max_age = max_age if max_age is not None else DEFAULT_MAX_AGE
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+
+    def _path(self, login_url, client_id, refresh_token):
+        key = hashlib.sha256('{}\n{}\n{}'.format(
+            login_url, client_id, refresh_token).encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, key + '.json')
+
+    def get(self, login_url, client_id, refresh_token):
+        """Returns the cached token response, or None if there is no token
+        or it has expired."""
+        path = self._path(login_url, client_id, refresh_token)
+        try:
+            with open(path, encoding='utf-8') as cache_file:
+                entry = json.load(cache_file)
+        except (OSError, ValueError):
+            return None
+
+        if time.time() > entry.get('expires_at', 0):
+            return None
+        return entry.get('auth')
+
+    def put(self, login_url, client_id, refresh_token, auth):
+        path = self._path(login_url, client_id, refresh_token)
+        entry = {'expires_at': time.time() + self.max_age, 'auth': auth}
+
+        # mkstemp creates the file readable and writable by its owner only
+        file_descriptor, temp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(file_descriptor, 'w', encoding='utf-8') as cache_file:
+                json.dump(entry, cache_file)
+            os.replace(temp_path, path)
+        except OSError:
+            LOGGER.warning("Could not write the token cache file %s", path)
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
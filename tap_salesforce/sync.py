@@ -1,41 +1,16 @@
 import time
 import singer
 import singer.utils as singer_utils
-from singer import Transformer, metadata, metrics
+from singer import metadata, metrics
 from requests.exceptions import RequestException
 from tap_salesforce.salesforce.bulk import Bulk
+from tap_salesforce.salesforce.exceptions import TapSalesforceBatchFailedException
+from tap_salesforce.datetimes import format_datetime, to_bookmark_key
+from tap_salesforce.output import RecordWriter, write_message, write_state
+from tap_salesforce.transform import RecordTransformer
 
 LOGGER = singer.get_logger()
 
-BLACKLISTED_FIELDS = set(['attributes'])
-
-
-def remove_blacklisted_fields(data):
-    return {k: v for k, v in data.items() if k not in BLACKLISTED_FIELDS}
-
-# pylint: disable=unused-argument
-
-
-def transform_bulk_data_hook(data, typ, schema):
-    result = data
-    if isinstance(data, dict):
-        result = remove_blacklisted_fields(data)
-
-    # Salesforce can return the value '0.0' for integer typed fields. This
-    # causes a schema violation. Convert it to '0' if schema['type'] has
-    # integer.
-    if data == '0.0' and 'integer' in schema.get('type', []):
-        result = '0'
-
-    # Salesforce Bulk API returns CSV's with empty strings for text fields.
-    # When the text field is nillable and the data value is an empty string,
-    # change the data so that it is None.
-    if data == "" and "null" in schema['type']:
-        result = None
-
-    return result
-
-
 def get_stream_version(catalog_entry, state):
     tap_stream_id = catalog_entry['tap_stream_id']
     catalog_metadata = metadata.to_map(catalog_entry['metadata'])
@@ -46,7 +21,9 @@ def get_stream_version(catalog_entry, state):
     else:
         stream_version = singer.get_bookmark(state, tap_stream_id, 'version')
 
-    if replication_key:
+    # A full table sync resumed part way through its Id slices carries on
+    # with the version of the records it has already written
+    if replication_key or singer.get_bookmark(state, tap_stream_id, 'RestIdBoundaries') is not None:
         return stream_version
     return int(time.time() * 1000)
 
@@ -55,58 +32,90 @@ def resume_syncing_bulk_query(sf, catalog_entry, job_id, state, counter):
     bulk = Bulk(sf)
     current_bookmark = singer.get_bookmark(
         state, catalog_entry['tap_stream_id'], 'JobHighestBookmarkSeen') or sf.get_start_date(state, catalog_entry)
-    current_bookmark = singer_utils.strptime_with_tz(current_bookmark)
+    current_bookmark = to_bookmark_key(current_bookmark)
     batch_ids = singer.get_bookmark(
         state, catalog_entry['tap_stream_id'], 'BatchIDs')
 
     start_time = singer_utils.now()
+    start_time_key = format_datetime(start_time)
     stream = catalog_entry['stream']
     stream_alias = catalog_entry.get('stream_alias')
     catalog_metadata = metadata.to_map(catalog_entry.get('metadata'))
     replication_key = catalog_metadata.get((), {}).get('replication-key')
     stream_version = get_stream_version(catalog_entry, state)
     schema = catalog_entry['schema']
+    record_writer = RecordWriter(stream_alias or stream, stream_version, start_time)
+    anytype_fields = get_anytype_fields(schema)
 
     if not bulk.job_exists(job_id):
         LOGGER.info(
             "Found stored Job ID that no longer exists, resetting bookmark and removing JobID from state.")
         return counter
 
-    # Iterate over the remaining batches, removing them once they are synced
-    for batch_id in batch_ids[:]:
-        with Transformer(pre_hook=transform_bulk_data_hook) as transformer:
-            for rec in bulk.get_batch_results(job_id, batch_id, catalog_entry):
-                counter.increment()
-                rec = transformer.transform(rec, schema)
-                rec = fix_record_anytype(rec, schema)
-                singer.write_message(
-                    singer.RecordMessage(
-                        stream=(
-                            stream_alias or stream),
-                        record=rec,
-                        version=stream_version,
-                        time_extracted=start_time))
-
-                # Update bookmark if necessary
-                replication_key_value = replication_key and singer_utils.strptime_with_tz(
-                    rec[replication_key])
-                if replication_key_value and replication_key_value <= start_time and replication_key_value > current_bookmark:
-                    current_bookmark = singer_utils.strptime_with_tz(
-                        rec[replication_key])
-
-        state = singer.write_bookmark(state,
-                                      catalog_entry['tap_stream_id'],
-                                      'JobHighestBookmarkSeen',
-                                      singer_utils.strftime(current_bookmark))
-        batch_ids.remove(batch_id)
-        LOGGER.info(
-            "Finished syncing batch %s. Removing batch from state.", batch_id)
-        LOGGER.info("Batches to go: %d", len(batch_ids))
-        singer.write_state(state)
+    # Iterate over the remaining batches as they complete, removing them once
+    # they are synced. Batches from a pipelined PK chunked job may still be
+    # processing when we resume.
+    completed_batch_ids = bulk.iter_completed_batches(job_id, batch_ids[:])
+    try:
+        for batch_id, records in bulk.iter_batches_results(job_id, completed_batch_ids, catalog_entry):
+            with RecordTransformer(schema) as transformer:
+                for rec in records:
+                    counter.increment()
+                    rec = transformer.transform(rec)
+                    if anytype_fields:
+                        rec = fix_record_anytype(rec, schema, anytype_fields)
+                    record_writer.write(rec)
+
+                    # Update bookmark if necessary
+                    replication_key_value = replication_key and to_bookmark_key(rec[replication_key])
+                    if replication_key_value and replication_key_value <= start_time_key and replication_key_value > current_bookmark:
+                        current_bookmark = replication_key_value
+
+            state = singer.write_bookmark(state,
+                                          catalog_entry['tap_stream_id'],
+                                          'JobHighestBookmarkSeen',
+                                          current_bookmark)
+            batch_ids.remove(batch_id)
+            LOGGER.info(
+                "Finished syncing batch %s. Removing batch from state.", batch_id)
+            LOGGER.info("Batches to go: %d", len(batch_ids))
+            write_state(state)
+    except TapSalesforceBatchFailedException:
+        # The job can't be resumed, so the next run starts over from the existing bookmark
+        bulk.clear_job_state(state, catalog_entry['tap_stream_id'])
+        write_state(state)
+        raise
 
     return counter
 
 
+class StateCheckpointer():
+    """Writes a STATE message once a number of records have moved a bookmark
+    or a number of seconds have passed, whichever comes first.
+
+    Bookmarks only ever move past records that have already been written, so
+    the state is safe to resume from whenever it is written. Skipping some
+    of the writes only means more records are synced again on resume."""
+
+    def __init__(self, records, seconds):
+        self.records = records
+        self.seconds = seconds
+        self.pending = 0
+        self.last_write = time.monotonic()
+
+    def checkpoint(self, state):
+        """Called after a bookmark in state has moved."""
+        self.pending += 1
+        if self.pending >= self.records or time.monotonic() - self.last_write >= self.seconds:
+            self.flush(state)
+
+    def flush(self, state):
+        if self.pending:
+            write_state(state)
+        self.pending = 0
+        self.last_write = time.monotonic()
+
+
 def sync_stream(sf, catalog_entry, state):
     stream = catalog_entry['stream']
 
@@ -116,7 +125,7 @@ def sync_stream(sf, catalog_entry, state):
                 sync_records(sf, catalog_entry, state, counter)
             elif sf.source_type == 'report':
                 sync_report(sf, catalog_entry, state, counter)
-            singer.write_state(state)
+            write_state(state)
         except RequestException as ex:
             raise Exception("Error syncing {}: {} Response: {}".format(
                 stream, ex, ex.response.text))
@@ -128,10 +137,13 @@ def sync_stream(sf, catalog_entry, state):
 
 
 def sync_records(sf, catalog_entry, state, counter):
-    chunked_bookmark = singer_utils.strptime_with_tz(
+    # A resumed Bulk 2.0 job carries on from the highest bookmark it had seen
+    chunked_bookmark = to_bookmark_key(
+        singer.get_bookmark(state, catalog_entry['tap_stream_id'], 'JobHighestBookmarkSeen') or
         sf.get_start_date(state, catalog_entry))
     stream = catalog_entry['stream']
     schema = catalog_entry['schema']
+    anytype_fields = get_anytype_fields(schema)
     stream_alias = catalog_entry.get('stream_alias')
     catalog_metadata = metadata.to_map(catalog_entry['metadata'])
     replication_key = catalog_metadata.get((), {}).get('replication-key')
@@ -140,61 +152,71 @@ def sync_records(sf, catalog_entry, state, counter):
                                                              version=stream_version)
 
     start_time = singer_utils.now()
+    start_time_key = format_datetime(start_time)
+    checkpointer = StateCheckpointer(sf.state_checkpoint_records, sf.state_checkpoint_seconds)
+    record_writer = RecordWriter(stream_alias or stream, stream_version, start_time)
+
+    # Keep the version of a full table sync in state until it completes, so
+    # a resumed sync writes its records with the same one
+    if not replication_key:
+        state = singer.write_bookmark(
+            state, catalog_entry['tap_stream_id'], 'version', stream_version)
+
+    # Whether the records are not ordered by the replication key, which
+    # Bulk queries mark in the stream's state before yielding any records
+    unordered = None
 
     LOGGER.info('Syncing Salesforce data for stream %s', stream)
 
-    for rec in sf.query(catalog_entry, state):
-        counter.increment()
-        with Transformer(pre_hook=transform_bulk_data_hook) as transformer:
-            rec = transformer.transform(rec, schema)
-        rec = fix_record_anytype(rec, schema)
-        singer.write_message(
-            singer.RecordMessage(
-                stream=(
-                    stream_alias or stream),
-                record=rec,
-                version=stream_version,
-                time_extracted=start_time))
-
-        replication_key_value = replication_key and singer_utils.strptime_with_tz(
-            rec[replication_key])
-
-        if sf.pk_chunking:
-            if replication_key_value and replication_key_value <= start_time and replication_key_value > chunked_bookmark:
-                # Replace the highest seen bookmark and save the state in case we need to resume later
-                chunked_bookmark = singer_utils.strptime_with_tz(
-                    rec[replication_key])
+    with RecordTransformer(schema) as transformer:
+        for rec in sf.query(catalog_entry, state):
+            counter.increment()
+            rec = transformer.transform(rec)
+            if anytype_fields:
+                rec = fix_record_anytype(rec, schema, anytype_fields)
+            record_writer.write(rec)
+
+            if unordered is None:
+                unordered = singer.get_bookmark(
+                    state, catalog_entry['tap_stream_id'], 'JobHighestBookmarkSeen') is not None
+
+            replication_key_value = replication_key and to_bookmark_key(rec[replication_key])
+
+            if unordered:
+                if replication_key_value and replication_key_value <= start_time_key and replication_key_value > chunked_bookmark:
+                    # Replace the highest seen bookmark and save the state in case we need to resume later
+                    chunked_bookmark = replication_key_value
+                    state = singer.write_bookmark(
+                        state,
+                        catalog_entry['tap_stream_id'],
+                        'JobHighestBookmarkSeen',
+                        chunked_bookmark)
+                    checkpointer.checkpoint(state)
+            # Before writing a bookmark, make sure Salesforce has not given us a
+            # record with one outside our range
+            elif replication_key_value and replication_key_value <= start_time_key:
                 state = singer.write_bookmark(
                     state,
                     catalog_entry['tap_stream_id'],
-                    'JobHighestBookmarkSeen',
-                    singer_utils.strftime(chunked_bookmark))
-                singer.write_state(state)
-        # Before writing a bookmark, make sure Salesforce has not given us a
-        # record with one outside our range
-        elif replication_key_value and replication_key_value <= start_time:
-            state = singer.write_bookmark(
-                state,
-                catalog_entry['tap_stream_id'],
-                replication_key,
-                rec[replication_key])
-            singer.write_state(state)
-
-        # Tables with no replication_key will send an
-        # activate_version message for the next sync
+                    replication_key,
+                    rec[replication_key])
+                checkpointer.checkpoint(state)
+
+            # Tables with no replication_key will send an
+            # activate_version message for the next sync
     if not replication_key:
-        singer.write_message(activate_version_message)
+        write_message(activate_version_message)
         state = singer.write_bookmark(
             state, catalog_entry['tap_stream_id'], 'version', None)
 
-    # If pk_chunking is set, only write a bookmark at the end
-    if sf.pk_chunking:
+    # Unordered records only move the bookmark at the end
+    if unordered and replication_key:
         # Write a bookmark with the highest value we've seen
         state = singer.write_bookmark(
             state,
             catalog_entry['tap_stream_id'],
             replication_key,
-            singer_utils.strftime(chunked_bookmark))
+            chunked_bookmark)
 
 
 def sync_report(sf, catalog_entry, state, counter):
@@ -206,10 +228,9 @@ def sync_report(sf, catalog_entry, state, counter):
         raise Exception(
             'report_id in the stream should match the report_id in the config')
 
-    chunked_bookmark = singer_utils.strptime_with_tz(
-        sf.get_start_date(state, catalog_entry))
     stream = catalog_entry['stream']
     schema = catalog_entry['schema']
+    anytype_fields = get_anytype_fields(schema)
     stream_alias = catalog_entry.get('stream_alias')
     catalog_metadata = metadata.to_map(catalog_entry['metadata'])
     replication_key = catalog_metadata.get((), {}).get('replication-key')
@@ -218,84 +239,94 @@ def sync_report(sf, catalog_entry, state, counter):
                                                              version=stream_version)
 
     start_time = singer_utils.now()
+    start_time_key = format_datetime(start_time)
+    record_writer = RecordWriter(stream_alias or stream, stream_version, start_time)
+
+    highest_bookmark = ''
+    highest_value = None
 
     LOGGER.info('Syncing Salesforce report data for stream %s', stream)
 
-    for rec in sf.query_report(catalog_entry, state):
-        counter.increment()
-        with Transformer() as transformer:
-            rec = transformer.transform(rec, schema)
-        rec = fix_record_anytype(rec, schema)
-
-        singer.write_message(
-            singer.RecordMessage(
-                stream=(
-                    stream_alias or stream),
-                record=rec,
-                version=stream_version,
-                time_extracted=start_time))
-
-        replication_key_value = replication_key and singer_utils.strptime_with_tz(
-            rec[replication_key])
-
-        if sf.pk_chunking:
-            if replication_key_value and replication_key_value <= start_time and replication_key_value > chunked_bookmark:
-                # Replace the highest seen bookmark and save the state in case we need to resume later
-                chunked_bookmark = singer_utils.strptime_with_tz(
-                    rec[replication_key])
-                state = singer.write_bookmark(
-                    state,
-                    catalog_entry['tap_stream_id'],
-                    'JobHighestBookmarkSeen',
-                    singer_utils.strftime(chunked_bookmark))
-                singer.write_state(state)
-        # Before writing a bookmark, make sure Salesforce has not given us a
-        # record with one outside our range
-        elif replication_key_value and replication_key_value <= start_time:
-            state = singer.write_bookmark(
-                state,
-                catalog_entry['tap_stream_id'],
-                replication_key,
-                rec[replication_key])
-            singer.write_state(state)
-
-        # Tables with no replication_key will send an
-        # activate_version message for the next sync
+    with RecordTransformer(schema, bulk_data_hook=False) as transformer:
+        for rec in sf.query_report(catalog_entry, state):
+            counter.increment()
+            rec = transformer.transform(rec)
+            if anytype_fields:
+                rec = fix_record_anytype(rec, schema, anytype_fields)
+
+            record_writer.write(rec)
+
+            replication_key_value = replication_key and to_bookmark_key(rec[replication_key])
+
+            # Report rows are not ordered by the replication key and a report
+            # run cannot be resumed part way, so only the highest value seen
+            # in our range is kept, and written once the report is synced
+            if replication_key_value and start_time_key >= replication_key_value > highest_bookmark:
+                highest_bookmark = replication_key_value
+                highest_value = rec[replication_key]
+
+            # Tables with no replication_key will send an
+            # activate_version message for the next sync
     if not replication_key:
-        singer.write_message(activate_version_message)
+        write_message(activate_version_message)
         state = singer.write_bookmark(
             state, catalog_entry['tap_stream_id'], 'version', None)
 
-    # If pk_chunking is set, only write a bookmark at the end
-    if sf.pk_chunking:
-        # Write a bookmark with the highest value we've seen
+    # A report that returned only some of its rows may have left out rows
+    # below the highest value, which the next run's filter would skip
+    truncated = state.get('bookmarks', {}).get(catalog_entry['tap_stream_id'], {}).pop('ReportTruncated', False)
+    if truncated and highest_value is not None:
+        LOGGER.warning("Not moving the bookmark of report %s since some of its rows were not synced", stream)
+    elif highest_value is not None:
         state = singer.write_bookmark(
             state,
             catalog_entry['tap_stream_id'],
             replication_key,
-            singer_utils.strftime(chunked_bookmark))
+            highest_value)
 
 
-def fix_record_anytype(rec, schema):
-    """Modifies a record when the schema has no 'type' element due to a SF type of 'anyType.'
-    Attempts to set the record's value for that element to an int, float, or string."""
-    def try_cast(val, coercion):
-        try:
-            return coercion(val)
-        except BaseException:
+# A string can only be parsed by float() if, after any whitespace, it starts
+# with a sign, a digit, a '.' or the 'n' and 'i' of 'nan' and 'inf'
+NON_NUMERIC_INITIALS = frozenset(
+    'abcdefghjklmopqrstuvwxyzABCDEFGHJKLMOPQRSTUVWXYZ')
+
+
+def get_anytype_fields(schema):
+    """Returns the fields whose schema has no 'type' element due to a SF type
+    in LOOSE_TYPES, so they only have to be found once per stream. Fields
+    with an 'anyOf' (date-times) have already been typed by the transform."""
+    return tuple(k for k, v in schema.get('properties', {}).items()
+                 if v.get('type') is None and 'anyOf' not in v)
+
+
+def coerce_anytype(val):
+    """Coerces an untyped value to a float, boolean or None, or leaves it as is."""
+    if val.__class__ is str:
+        if val == "":
+            return None
+        if val in ("true", "false"):
+            return val == "true"
+        # Most anyType values are Ids or text, don't raise for those
+        if val[0] in NON_NUMERIC_INITIALS:
             return val
 
-    for k, v in rec.items():
-        if schema['properties'][k].get("type") is None:
-            val = v
-            val = try_cast(v, int)
-            val = try_cast(v, float)
-            if v in ["true", "false"]:
-                val = (v == "true")
+    try:
+        return float(val)
+    except BaseException:
+        return val
+
+
+def fix_record_anytype(rec, schema, anytype_fields=None):
+    """Modifies a record when the schema has no 'type' element due to a SF type of 'anyType.'
+    Attempts to set the record's value for that element to a float, boolean or string.
 
-            if v == "":
-                val = None
+    Pass anytype_fields from get_anytype_fields to avoid working them out
+    from the schema for every record."""
+    if anytype_fields is None:
+        anytype_fields = get_anytype_fields(schema)
 
-            rec[k] = val
+    for k in anytype_fields:
+        if k in rec:
+            rec[k] = coerce_anytype(rec[k])
 
     return rec
@@ -0,0 +1,311 @@
+import singer
+from singer import Transformer
+from tap_salesforce.datetimes import string_to_datetime
+
+LOGGER = singer.get_logger()
+
+BLACKLISTED_FIELDS = set(['attributes'])
+
+
+def remove_blacklisted_fields(data):
+    return {k: v for k, v in data.items() if k not in BLACKLISTED_FIELDS}
+
+# pylint: disable=unused-argument
+
+
+def transform_bulk_data_hook(data, typ, schema):
+    result = data
+    if isinstance(data, dict):
+        result = remove_blacklisted_fields(data)
+
+    # Salesforce can return the value '0.0' for integer typed fields. This
+    # causes a schema violation. Convert it to '0' if schema['type'] has
+    # integer.
+    if data == '0.0' and 'integer' in schema.get('type', []):
+        result = '0'
+
+    # Salesforce Bulk API returns CSV's with empty strings for text fields.
+    # When the text field is nillable and the data value is an empty string,
+    # change the data so that it is None.
+    if data == "" and "null" in schema['type']:
+        result = None
+
+    return result
+
+
+FAILED = (False, None)
+NULL = (True, None)
+
+
+def _identity(data):
+    return True, data
+
+
+def _compile_hook(schema, bulk_data_hook):
+    """Returns transform_bulk_data_hook specialised to a schema, or None."""
+    if not bulk_data_hook:
+        return None
+
+    zero_to_integer = 'integer' in schema.get('type', [])
+    empty_to_null = 'null' in schema['type']
+
+    def hook(data):
+        result = data
+        if isinstance(data, dict):
+            result = remove_blacklisted_fields(data)
+        if zero_to_integer and data == '0.0':
+            result = '0'
+        if empty_to_null and data == "":
+            result = None
+        return result
+
+    return hook
+
+
+# pylint: disable=too-many-return-statements
+def _compile_type(typ, schema, bulk_data_hook):
+    """Compiles singer.Transformer._transform for one type of a schema."""
+    hook = _compile_hook(schema, bulk_data_hook)
+
+    if typ == "null":
+        def convert(data):
+            return NULL if data is None or data == "" else FAILED
+    elif schema.get("format") == "date-time":
+        def convert(data):
+            if data is None or data == "":
+                return FAILED
+            data = string_to_datetime(data)
+            return FAILED if data is None else (True, data)
+    elif typ == "object":
+        properties = schema.get("properties", {})
+        converters = {k: _compile(v, bulk_data_hook) for k, v in properties.items()}
+
+        def convert(data):
+            if not isinstance(data, dict):
+                return False, data
+            if properties == {}:
+                return True, data
+            return _convert_object(data, converters, bulk_data_hook)
+    elif typ == "array":
+        convert_item = _compile(schema["items"], bulk_data_hook)
+
+        def convert(data):
+            if not isinstance(data, list):
+                return False, data
+            results = [convert_item(row) for row in data]
+            return all(success for success, _ in results), [value for _, value in results]
+    elif typ == "string":
+        def convert(data):
+            if data is None:
+                return FAILED
+            try:
+                return True, str(data)
+            except Exception:
+                return FAILED
+    elif typ in ("integer", "number"):
+        cast = int if typ == "integer" else float
+
+        def convert(data):
+            if isinstance(data, str):
+                data = data.replace(",", "")
+            try:
+                return True, cast(data)
+            except Exception:
+                return FAILED
+    elif typ == "boolean":
+        def convert(data):
+            if isinstance(data, str) and data.lower() == "false":
+                return True, False
+            try:
+                return True, bool(data)
+            except Exception:
+                return FAILED
+    else:
+        return lambda data: FAILED
+
+    if hook is None:
+        return convert
+    return lambda data: convert(hook(data))
+
+
+def _compile_first_success(converters):
+    if len(converters) == 1:
+        return converters[0]
+
+    def convert(data):
+        for converter in converters:
+            result = converter(data)
+            if result[0]:
+                return result
+        return FAILED
+
+    return convert
+
+
+def _compile_fast_path(schema, convert, bulk_data_hook):
+    """Most values come from the Bulk API as strings and most fields use one
+    of the schemas field_to_property_schema builds, so those get a shortcut
+    that gives the same result as the general converter."""
+    if not bulk_data_hook:
+        return convert
+
+    if 'anyOf' in schema:
+        if schema['anyOf'] != [{"type": "string", "format": "date-time"}, {"type": ["string", "null"]}]:
+            return convert
+
+        def convert_date_time(data):
+            if data.__class__ is not str:
+                return convert(data)
+            if data == "":
+                return NULL
+            return True, string_to_datetime(data) or data
+        return convert_date_time
+
+    types = schema.get('type')
+    if types == "string":
+        def convert_string(data):
+            if data.__class__ is not str:
+                return convert(data)
+            return True, data
+        return convert_string
+
+    if not isinstance(types, list) or "null" not in types:
+        return convert
+    # null is always tried last, the order of the other types matters
+    types = [t for t in types if t != "null"]
+
+    if types == ["string"] and "format" not in schema:
+        def convert_nullable_string(data):
+            if data.__class__ is not str:
+                return convert(data)
+            return NULL if data == "" else (True, data)
+        return convert_nullable_string
+
+    if types == ["boolean"]:
+        def convert_boolean(data):
+            if data.__class__ is not str:
+                return convert(data)
+            return True, data != "" and data.lower() != "false"
+        return convert_boolean
+
+    if types == ["integer"]:
+        def convert_integer(data):
+            if data.__class__ is not str:
+                return convert(data)
+            if data == "":
+                return NULL
+            try:
+                return True, int('0' if data == '0.0' else data.replace(",", ""))
+            except ValueError:
+                return FAILED
+        return convert_integer
+
+    if types == ["number"]:
+        def convert_number(data):
+            if data.__class__ is not str:
+                return convert(data)
+            if data == "":
+                return NULL
+            try:
+                return True, float(data.replace(",", ""))
+            except ValueError:
+                return FAILED
+        return convert_number
+
+    if types == ["number", "string"]:
+        def convert_number_or_string(data):
+            if data.__class__ is not str:
+                return convert(data)
+            if data == "":
+                return NULL
+            try:
+                return True, float(data.replace(",", ""))
+            except ValueError:
+                return True, data
+        return convert_number_or_string
+
+    return convert
+
+
+def _compile(schema, bulk_data_hook):
+    """Compiles singer.Transformer.transform_recur for a schema into a
+    function that takes a value and returns a (success, value) pair."""
+    if "anyOf" in schema:
+        convert = _compile_first_success(
+            [_compile(subschema, bulk_data_hook) for subschema in schema['anyOf']])
+    elif "type" not in schema:
+        # indicates no typing information so don't bother transforming it
+        convert = _identity
+    else:
+        types = schema["type"]
+        if not isinstance(types, list):
+            types = [types]
+
+        # null is always tried last
+        types = [t for t in types if t != "null"] + (["null"] if "null" in types else [])
+
+        convert = _compile_first_success(
+            [_compile_type(typ, schema, bulk_data_hook) for typ in types])
+
+    return _compile_fast_path(schema, convert, bulk_data_hook)
+
+
+def _convert_object(data, converters, bulk_data_hook, removed=None):
+    result = {}
+    success = True
+    for key, value in data.items():
+        if bulk_data_hook and key in BLACKLISTED_FIELDS:
+            continue
+        converter = converters.get(key)
+        if converter is None:
+            if removed is not None:
+                removed.add(key)
+            continue
+        field_success, result[key] = converter(value)
+        success = success and field_success
+
+    return success, result
+
+
+class RecordTransformer():
+    """Transforms records to a catalog entry's schema, giving the same results
+    as singer.Transformer, optionally with transform_bulk_data_hook as its
+    pre_hook.
+
+    Instead of walking the schema for every record, the schema is compiled
+    once into a converter per field. When a record does not match, it is
+    handed to singer.Transformer so that the same SchemaMismatch is raised."""
+
+    def __init__(self, schema, bulk_data_hook=True):
+        self.schema = schema
+        self.bulk_data_hook = bulk_data_hook
+        self.removed = set()
+
+        properties = schema.get('properties', {})
+        if schema.get('type') == 'object' and properties:
+            self.converters = {k: _compile(v, bulk_data_hook) for k, v in properties.items()}
+        else:
+            self.converters = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        if self.removed:
+            LOGGER.warning("Removed %s paths during transforms:\n\t%s",
+                           len(self.removed),
+                           "\n\t".join(sorted(self.removed)))
+            # Output list format to parse for reporting
+            LOGGER.warning("Removed paths list: %s", sorted(self.removed))
+
+    def transform(self, data):
+        if self.converters is not None and isinstance(data, dict):
+            success, result = _convert_object(data, self.converters, self.bulk_data_hook, self.removed)
+            if success:
+                return result
+
+        pre_hook = transform_bulk_data_hook if self.bulk_data_hook else None
+        transformer = Transformer(pre_hook=pre_hook)
+        result = transformer.transform(data, self.schema)
+        self.removed.update(transformer.removed)
+        return result
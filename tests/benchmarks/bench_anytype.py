@@ -0,0 +1,80 @@
+"""Times the anyType coercion of fix_record_anytype on a 500 column record,
+against the per-record schema scan and cast cascade it replaced.
+
+    python tests/benchmarks/bench_anytype.py
+"""
+import timeit
+
+from tap_salesforce.sync import fix_record_anytype, get_anytype_fields
+
+COLUMNS = 500
+RECORDS = 2000
+REPEATS = 5
+
+# Values as the Bulk API returns them, which the untyped fields cycle through
+ANYTYPE_VALUES = ['12', '3.5', 'true', 'false', '', 'Closed Won', '2021-01-01', 'NaN']
+
+
+def fix_record_anytype_before(rec, schema):
+    """fix_record_anytype as it was, checking every field of the schema for
+    every record and trying each cast in turn."""
+    def try_cast(val, coercion):
+        try:
+            return coercion(val)
+        except BaseException:
+            return val
+
+    for k, v in rec.items():
+        if schema['properties'][k].get("type") is None:
+            val = v
+            val = try_cast(v, int)
+            val = try_cast(v, float)
+            if v in ["true", "false"]:
+                val = (v == "true")
+
+            if v == "":
+                val = None
+
+            rec[k] = val
+
+    return rec
+
+
+def make_stream(anytype_columns):
+    properties = {}
+    record = {}
+    for i in range(COLUMNS):
+        name = 'Field{}__c'.format(i)
+        if i < anytype_columns:
+            properties[name] = {}
+            record[name] = ANYTYPE_VALUES[i % len(ANYTYPE_VALUES)]
+        else:
+            properties[name] = {'type': ['null', 'string']}
+            record[name] = 'value {}'.format(i)
+    return {'type': 'object', 'properties': properties}, record
+
+
+def time_per_record(fix, schema, record):
+    def run():
+        for _ in range(RECORDS):
+            fix(dict(record), schema)
+    return min(timeit.repeat(run, number=1, repeat=REPEATS)) / RECORDS * 1e6
+
+
+def main():
+    for anytype_columns in (50, 0):
+        schema, record = make_stream(anytype_columns)
+        anytype_fields = get_anytype_fields(schema)
+
+        before = time_per_record(fix_record_anytype_before, schema, record)
+        if anytype_fields:
+            after = "{:.1f}us per record".format(time_per_record(
+                lambda rec, schema: fix_record_anytype(rec, schema, anytype_fields), schema, record))
+        else:
+            # sync_records skips the pass when a stream has no anyType fields
+            after = "skipped"
+        print("{:>3} anyType fields: {:.1f}us per record -> {}".format(anytype_columns, before, after))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+import http.server
+import json
+import threading
+import urllib.parse
+
+
+class Request():
+    def __init__(self, handler, body):
+        parsed = urllib.parse.urlsplit(handler.path)
+        self.method = handler.command
+        self.path = parsed.path
+        self.query = dict(urllib.parse.parse_qsl(parsed.query))
+        self.headers = handler.headers
+        self.body = body
+
+    def json(self):
+        return json.loads(self.body)
+
+
+class StandInServer():
+    """Serves a Salesforce API stand-in from a local HTTP server on a
+    background thread, for the duration of a with block.
+
+    Routes map a method and a path to a function that takes the Request and
+    returns a status, a dict of headers and a body, which is sent as JSON
+    unless it is bytes. Every request is kept in requests."""
+
+    def __init__(self):
+        self.routes = {}
+        self.requests = []
+        self.server = None
+        self.thread = None
+
+    def route(self, method, path, respond):
+        self.routes[(method, path)] = respond
+
+    @property
+    def url(self):
+        host, port = self.server.server_address
+        return "http://{}:{}".format(host, port)
+
+    def __enter__(self):
+        stand_in = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def _respond(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                request = Request(self, self.rfile.read(length))
+                stand_in.requests.append(request)
+
+                respond = stand_in.routes.get((request.method, request.path))
+                if respond is None:
+                    status, headers, body = 404, {}, [{"errorCode": "NOT_FOUND"}]
+                else:
+                    status, headers, body = respond(request)
+
+                if not isinstance(body, bytes):
+                    body = json.dumps(body).encode('utf-8')
+                    headers = dict({'Content-Type': 'application/json'}, **headers)
+
+                self.send_response(status)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            do_GET = _respond
+            do_POST = _respond
+
+            def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+                pass
+
+        self.server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.thread = threading.Thread(target=self.server.serve_forever, args=(0.05,), daemon=True)
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
@@ -0,0 +1,36 @@
+import unittest
+
+from tap_salesforce.sync import coerce_anytype, fix_record_anytype, get_anytype_fields
+
+SCHEMA = {'type': 'object', 'properties': {
+    'Amount__c': {},
+    'Name': {'type': ['null', 'string']},
+    'CreatedDate': {'anyOf': [{'type': 'string', 'format': 'date-time'},
+                              {'type': ['string', 'null']}]},
+}}
+
+
+class TestAnyType(unittest.TestCase):
+
+    def test_only_untyped_fields_are_coerced(self):
+        self.assertEqual(get_anytype_fields(SCHEMA), ('Amount__c',))
+
+    def test_values_are_coerced_to_floats_booleans_or_none(self):
+        self.assertEqual(coerce_anytype('12'), 12.0)
+        self.assertEqual(coerce_anytype('-3.5'), -3.5)
+        self.assertEqual(coerce_anytype('1e3'), 1000.0)
+        self.assertIs(coerce_anytype('true'), True)
+        self.assertIs(coerce_anytype('false'), False)
+        self.assertIsNone(coerce_anytype(''))
+        self.assertEqual(coerce_anytype('Closed Won'), 'Closed Won')
+        self.assertEqual(coerce_anytype('2021-01-01'), '2021-01-01')
+        self.assertEqual(coerce_anytype(7), 7)
+
+    def test_record_is_coerced_in_place(self):
+        rec = {'Amount__c': '10', 'Name': '10'}
+        fix_record_anytype(rec, SCHEMA)
+        self.assertEqual(rec, {'Amount__c': 10.0, 'Name': '10'})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,111 @@
+import unittest
+from unittest import mock
+
+import singer
+
+from tap_salesforce.salesforce import Salesforce
+from tap_salesforce.salesforce.bulk2 import Bulk2
+from tap_salesforce.salesforce.exceptions import TapSalesforceException
+
+from stand_in_server import StandInServer
+
+JOBS_PATH = '/services/data/v48.0/jobs/query'
+JOB_ID = '7504x000000001'
+
+CATALOG_ENTRY = {
+    'stream': 'Account',
+    'tap_stream_id': 'Account',
+    'schema': {'type': 'object', 'properties': {'Id': {'type': 'string'},
+                                                'SystemModstamp': {'type': 'string'}}},
+    'metadata': [{'breadcrumb': (), 'metadata': {'replication-method': 'INCREMENTAL',
+                                                 'replication-key': 'SystemModstamp'}}],
+}
+
+# The result pages of the job, by the locator that fetches them
+PAGES = {
+    None: (b'"Id","SystemModstamp"\n"001A","2021-01-02T00:00:00.000Z"\n', 'MjAwMDA'),
+    'MjAwMDA': (b'"Id","SystemModstamp"\n"001B","2021-01-01T00:00:00.000Z"\n', 'null'),
+}
+
+
+class StandInBulk2(StandInServer):
+    """Simulates a Bulk API 2.0 query job that is in progress for its first
+    status poll and complete afterwards, with its results in two pages."""
+
+    def __init__(self, limits=None):
+        super().__init__()
+        self.limits = limits if limits is not None else \
+            {'DailyBulkV2QueryJobs': {'Max': 10000, 'Remaining': 9990}}
+        self.polls = 0
+        self.route('GET', '/services/data/v48.0/limits', lambda request: (200, {}, self.limits))
+        self.route('POST', JOBS_PATH, self.create_job)
+        self.route('GET', JOBS_PATH + '/' + JOB_ID, self.get_job)
+        self.route('GET', JOBS_PATH + '/' + JOB_ID + '/results', self.get_results)
+
+    def create_job(self, request):
+        return 200, {}, {'id': JOB_ID, 'state': 'UploadComplete', 'query': request.json()['query']}
+
+    def get_job(self, request):  # pylint: disable=unused-argument
+        self.polls += 1
+        return 200, {}, {'id': JOB_ID, 'state': 'InProgress' if self.polls == 1 else 'JobComplete'}
+
+    def get_results(self, request):
+        body, next_locator = PAGES[request.query.get('locator')]
+        return 200, {'Sforce-Locator': next_locator, 'Content-Type': 'text/csv'}, body
+
+
+def salesforce(server):
+    sf = Salesforce(default_start_date='2020-01-01T00:00:00Z',
+                    source_type='object',
+                    object_name='Account',
+                    api_type='BULK2',
+                    select_fields_by_default=True,
+                    bulk2_max_records=1)
+    sf.access_token = 'token'
+    sf.instance_url = server.url
+    return sf
+
+
+@mock.patch('tap_salesforce.salesforce.bulk2.JOB_STATUS_POLLING_MIN_SLEEP', 0.01)
+@mock.patch('tap_salesforce.salesforce.bulk2.write_state', mock.Mock())
+class TestBulk2(unittest.TestCase):
+
+    def test_query_reads_every_page_of_the_job(self):
+        with StandInBulk2() as server:
+            state = {}
+            records = list(Bulk2(salesforce(server)).query(CATALOG_ENTRY, state))
+
+        self.assertEqual([r['Id'] for r in records], ['001A', '001B'])
+        create_job = [r for r in server.requests if r.method == 'POST'][0].json()
+        self.assertEqual(create_job['query'],
+                         "SELECT Id,SystemModstamp FROM Account WHERE SystemModstamp >= 2020-01-01T00:00:00Z ")
+        self.assertEqual(server.polls, 2)
+        self.assertEqual([r.query.get('maxRecords') for r in server.requests if r.path.endswith('/results')],
+                         ['1', '1'])
+        self.assertNotIn('Bulk2JobID', state['bookmarks']['Account'])
+
+    def test_query_resumes_from_the_saved_locator(self):
+        with StandInBulk2() as server:
+            state = {'bookmarks': {'Account': {'Bulk2JobID': JOB_ID, 'Bulk2Locator': 'MjAwMDA'}}}
+            records = list(Bulk2(salesforce(server)).query(CATALOG_ENTRY, state))
+
+        self.assertEqual([r['Id'] for r in records], ['001B'])
+        self.assertFalse([r for r in server.requests if r.method == 'POST'])
+
+    def test_locator_of_each_page_is_saved_in_state(self):
+        with StandInBulk2() as server:
+            state = {}
+            query = Bulk2(salesforce(server)).query(CATALOG_ENTRY, state)
+            next(query)
+            next(query)
+            self.assertEqual(singer.get_bookmark(state, 'Account', 'Bulk2Locator'), 'MjAwMDA')
+            query.close()
+
+    def test_missing_limit_fails_clearly(self):
+        with StandInBulk2(limits={'DailyBulkApiRequests': {'Max': 10000, 'Remaining': 9990}}) as server:
+            with self.assertRaisesRegex(TapSalesforceException, 'DailyBulkV2QueryJobs'):
+                list(Bulk2(salesforce(server)).query(CATALOG_ENTRY, {}))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,34 @@
+import unittest
+
+from tap_salesforce.salesforce import Salesforce
+
+
+def salesforce(**config):
+    return Salesforce(default_start_date='2020-01-01T00:00:00Z',
+                      source_type='object',
+                      object_name='Account',
+                      **config)
+
+
+class TestConfig(unittest.TestCase):
+
+    def test_blank_values_use_the_defaults(self):
+        sf = salesforce(rest_id_chunks='', rest_batch_size=' ', state_checkpoint_seconds='')
+        self.assertEqual(sf.rest_id_chunks, 1)
+        self.assertIsNone(sf.rest_batch_size)
+        self.assertEqual(sf.state_checkpoint_seconds, 60)
+
+    def test_string_values_are_parsed(self):
+        sf = salesforce(stream_concurrency='3', quota_percent_total='50', is_sandbox='True')
+        self.assertEqual(sf.stream_concurrency, 3)
+        self.assertEqual(sf.quota_percent_total, 50.0)
+        self.assertTrue(sf.is_sandbox)
+
+    def test_integers_are_kept_to_their_minimum(self):
+        sf = salesforce(rest_window_concurrency=0, rest_prefetch_pages=-1)
+        self.assertEqual(sf.rest_window_concurrency, 1)
+        self.assertEqual(sf.rest_prefetch_pages, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
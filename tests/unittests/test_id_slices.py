@@ -0,0 +1,90 @@
+import contextlib
+import io
+import json
+import unittest
+
+import singer
+
+from tap_salesforce import build_state
+from tap_salesforce.sync import sync_records
+
+
+CATALOG_ENTRY = {
+    'stream': 'Account',
+    'tap_stream_id': 'Account',
+    'schema': {'type': 'object', 'properties': {'Id': {'type': 'string'}}},
+    'metadata': [{'breadcrumb': (), 'metadata': {'replication-method': 'FULL_TABLE'}}],
+}
+
+
+class Interrupted(Exception):
+    pass
+
+
+class FakeSalesforce():
+    """Stands in for an Id sliced REST sync that is interrupted after its
+    first slice, or syncs the slices it had not finished when resumed."""
+    pk_chunking = False
+    state_checkpoint_records = 1
+    state_checkpoint_seconds = 0
+
+    def __init__(self, interrupt):
+        self.interrupt = interrupt
+
+    def get_start_date(self, state, catalog_entry):  # pylint: disable=unused-argument
+        return '2020-01-01T00:00:00Z'
+
+    def query(self, catalog_entry, state):
+        tap_stream_id = catalog_entry['tap_stream_id']
+        if singer.get_bookmark(state, tap_stream_id, 'RestIdBoundaries') is None:
+            singer.write_bookmark(state, tap_stream_id, 'RestIdBoundaries', ['001000000000002'])
+            singer.write_bookmark(state, tap_stream_id, 'RestIdSlicesSynced', 0)
+            yield {'Id': '001000000000001'}
+            singer.write_bookmark(state, tap_stream_id, 'RestIdSlicesSynced', 1)
+            if self.interrupt:
+                raise Interrupted()
+        yield {'Id': '001000000000002'}
+        for key in ('RestIdBoundaries', 'RestIdSlicesSynced'):
+            state['bookmarks'][tap_stream_id].pop(key)
+
+
+def sync(sf, state):
+    """Returns the messages sync_records writes, and whether it finished."""
+    stdout = io.StringIO()
+    finished = True
+    with contextlib.redirect_stdout(stdout):
+        try:
+            sync_records(sf, CATALOG_ENTRY, state, singer.metrics.Counter('record_count'))
+        except Interrupted:
+            finished = False
+    return [json.loads(line) for line in stdout.getvalue().splitlines()], finished
+
+
+class TestResumedIdSlices(unittest.TestCase):
+
+    def test_resumed_sync_keeps_the_version_of_the_interrupted_one(self):
+        state = {}
+        messages, finished = sync(FakeSalesforce(interrupt=True), state)
+        self.assertFalse(finished)
+        first_version = messages[0]['version']
+        self.assertEqual(singer.get_bookmark(state, 'Account', 'version'), first_version)
+
+        catalog = {'streams': [CATALOG_ENTRY]}
+        state = build_state(json.loads(json.dumps(state)), catalog)
+        messages, finished = sync(FakeSalesforce(interrupt=False), state)
+        self.assertTrue(finished)
+
+        records = [m for m in messages if m['type'] == 'RECORD']
+        activate_version = [m for m in messages if m['type'] == 'ACTIVATE_VERSION']
+        self.assertEqual([r['version'] for r in records], [first_version])
+        self.assertEqual([m['version'] for m in activate_version], [first_version])
+        self.assertIsNone(singer.get_bookmark(state, 'Account', 'version'))
+
+    def test_full_table_sync_from_scratch_gets_a_new_version(self):
+        state = {'bookmarks': {'Account': {'version': 1}}}
+        messages, _ = sync(FakeSalesforce(interrupt=False), state)
+        self.assertNotEqual(messages[0]['version'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,72 @@
+import contextlib
+import io
+import unittest
+
+import singer
+
+from tap_salesforce.salesforce.report_rest import ReportRest
+from tap_salesforce.sync import sync_report
+
+REPORT_ID = '00O000000000001'
+
+CATALOG_ENTRY = {
+    'stream': 'Opportunities',
+    'tap_stream_id': REPORT_ID,
+    'schema': {'type': 'object', 'properties': {
+        'CREATED_DATE': {'anyOf': [{'type': 'string', 'format': 'date-time'},
+                                   {'type': ['string', 'null']}]}}},
+    'metadata': [{'breadcrumb': (), 'metadata': {'replication-method': 'INCREMENTAL',
+                                                 'replication-key': 'CREATED_DATE'}}],
+}
+
+REPORT = {
+    'reportMetadata': {'detailColumns': ['CREATED_DATE'], 'reportFilters': []},
+    'reportExtendedMetadata': {'detailColumnInfo': {'CREATED_DATE': {'dataType': 'datetime'}}},
+}
+
+
+class FakeSalesforce():
+    report_id = REPORT_ID
+    report_slice_column = None
+
+    def __init__(self, rows, all_data):
+        self.rows = rows
+        self.all_data = all_data
+
+    def get_start_date(self, state, catalog_entry):
+        return singer.get_bookmark(state, catalog_entry['tap_stream_id'], 'CREATED_DATE') or \
+            '2020-01-01T00:00:00Z'
+
+    def query_report(self, catalog_entry, state):
+        report_rest = ReportRest(self)
+        report_rest._run_report = self._run_report  # pylint: disable=protected-access
+        return report_rest._get_report_data(  # pylint: disable=protected-access
+            REPORT, catalog_entry, state, 'CREATED_DATE', self.get_start_date(state, catalog_entry))
+
+    def _run_report(self, report_metadata, catalog_entry, transform_row):  # pylint: disable=unused-argument
+        rows = [transform_row({'dataCells': [{'label': value, 'value': value}]}) for value in self.rows]
+        return rows, {'allData': self.all_data}
+
+
+def sync(sf, state):
+    with contextlib.redirect_stdout(io.StringIO()):
+        sync_report(sf, CATALOG_ENTRY, state, singer.metrics.Counter('record_count'))
+
+
+class TestReportBookmarks(unittest.TestCase):
+
+    def test_complete_report_moves_the_bookmark_to_the_highest_value(self):
+        state = {}
+        sync(FakeSalesforce(['2021-01-02T00:00:00Z', '2021-01-03T00:00:00Z', '2021-01-01T00:00:00Z'],
+                            all_data=True), state)
+        self.assertEqual(state['bookmarks'][REPORT_ID],
+                         {'CREATED_DATE': '2021-01-03T00:00:00.000000Z'})
+
+    def test_truncated_report_leaves_the_bookmark_where_it_was(self):
+        state = {'bookmarks': {REPORT_ID: {'CREATED_DATE': '2020-06-01T00:00:00Z'}}}
+        sync(FakeSalesforce(['2021-01-02T00:00:00Z', '2021-01-03T00:00:00Z'], all_data=False), state)
+        self.assertEqual(state['bookmarks'][REPORT_ID], {'CREATED_DATE': '2020-06-01T00:00:00Z'})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,149 @@
+import datetime
+import itertools
+import threading
+import time
+import unittest
+from unittest import mock
+
+from tap_salesforce.salesforce import Salesforce
+from tap_salesforce.salesforce.exceptions import TapSalesforceException
+from tap_salesforce.salesforce.report_rest import ReportRest, get_row_transform
+
+from stand_in_server import StandInServer
+
+REPORT_ID = '00O000000000001'
+INSTANCES_PATH = '/services/data/v48.0/analytics/reports/{}/instances'.format(REPORT_ID)
+
+REPORT = {
+    'reportMetadata': {'id': REPORT_ID,
+                       'detailColumns': ['OPPORTUNITY_NAME', 'CLOSE_DATE'],
+                       'reportFilters': [],
+                       'reportBooleanFilter': None},
+    'reportExtendedMetadata': {'detailColumnInfo': {'OPPORTUNITY_NAME': {'dataType': 'string'},
+                                                    'CLOSE_DATE': {'dataType': 'date'}}},
+}
+
+CATALOG_ENTRY = {'stream': 'Opportunities', 'tap_stream_id': REPORT_ID, 'metadata': []}
+
+# Rows of the report, a few of which have no close date
+ROWS = [('Opportunity {}'.format(i),
+         '' if i % 10 == 0 else (datetime.date(2021, 1, 1) + datetime.timedelta(days=i)).isoformat())
+        for i in range(40)]
+
+FILTERS = {
+    'equals': lambda value, filter_value: value == filter_value,
+    'notEqual': lambda value, filter_value: value != filter_value,
+    'greaterOrEqual': lambda value, filter_value: value != '' and value >= filter_value,
+    'lessThan': lambda value, filter_value: value != '' and value < filter_value,
+}
+
+
+class StandInReportInstances(StandInServer):
+    """Simulates the lifecycle of asynchronous report instances, which are
+    New, then Running for a number of polls, then Success or Error. Reports
+    return at most row_limit of their rows, filtered, sorted and limited by
+    their report metadata."""
+
+    def __init__(self, running_polls=2, row_limit=2000, error=None):
+        super().__init__()
+        self.running_polls = running_polls
+        self.row_limit = row_limit
+        self.error = error
+        self.instance_ids = itertools.count(1)
+        self.instances = {}
+        self.lock = threading.Lock()
+        self.running = 0
+        self.most_running = 0
+        self.route('POST', INSTANCES_PATH, self.create_instance)
+
+    def create_instance(self, request):
+        instance_id = '0LG{:012d}'.format(next(self.instance_ids))
+        with self.lock:
+            self.instances[instance_id] = {'report_metadata': request.json()['reportMetadata'], 'polls': 0}
+            self.running += 1
+            self.most_running = max(self.most_running, self.running)
+        self.route('GET', INSTANCES_PATH + '/' + instance_id, self.get_instance)
+        return 201, {}, {'id': instance_id, 'status': 'New'}
+
+    def get_instance(self, request):
+        instance_id = request.path.rsplit('/', 1)[1]
+        with self.lock:
+            instance = self.instances[instance_id]
+            instance['polls'] += 1
+            if instance['polls'] == 1:
+                return 200, {}, {'attributes': {'id': instance_id, 'status': 'New'}}
+            if instance['polls'] <= self.running_polls + 1:
+                return 200, {}, {'attributes': {'id': instance_id, 'status': 'Running'}}
+            if instance['polls'] == self.running_polls + 2:
+                self.running -= 1
+
+        if self.error:
+            return 200, {}, {'attributes': {'id': instance_id, 'status': 'Error', 'errorMessage': self.error}}
+
+        rows = self.run(instance['report_metadata'])
+        return 200, {}, {
+            'attributes': {'id': instance_id, 'status': 'Success'},
+            'allData': len(rows) <= self.row_limit,
+            'factMap': {'T!T': {'rows': [{'dataCells': [{'label': value, 'value': value or None}
+                                                        for value in row]}
+                                         for row in rows[:self.row_limit]]}},
+        }
+
+    def run(self, report_metadata):  # pylint: disable=no-self-use
+        columns = report_metadata['detailColumns']
+        rows = [row for row in ROWS
+                if all(FILTERS[f['operator']](row[columns.index(f['column'])], f['value'])
+                       for f in report_metadata['reportFilters'])]
+
+        for sort in report_metadata.get('sortBy') or []:
+            rows.sort(key=lambda row, sort=sort: row[columns.index(sort['sortColumn'])],
+                      reverse=sort['sortOrder'] == 'Desc')
+        if report_metadata.get('topRows'):
+            rows = rows[:report_metadata['topRows']['rowLimit']]
+        return rows
+
+
+def report_rest(server, **config):
+    sf = Salesforce(default_start_date='2020-01-01T00:00:00Z',
+                    source_type='report',
+                    report_id=REPORT_ID,
+                    report_async=True,
+                    **config)
+    sf.access_token = 'token'
+    sf.instance_url = server.url
+    return ReportRest(sf)
+
+
+@mock.patch('tap_salesforce.salesforce.report_rest.REPORT_INSTANCE_POLLING_MIN_SLEEP', 0.01)
+class TestReportInstances(unittest.TestCase):
+
+    def test_instance_is_polled_until_it_succeeds(self):
+        with StandInReportInstances(running_polls=2) as server:
+            rows, document = report_rest(server)._run_report(  # pylint: disable=protected-access
+                REPORT['reportMetadata'], CATALOG_ENTRY, get_row_transform(REPORT['reportMetadata']['detailColumns']))
+
+        self.assertEqual(len(rows), len(ROWS))
+        self.assertEqual(document['attributes']['status'], 'Success')
+        polls = [r for r in server.requests if r.method == 'GET']
+        self.assertEqual(len(polls), 4)
+
+    def test_failed_instance_raises(self):
+        with StandInReportInstances(running_polls=0, error='Report timed out') as server:
+            with self.assertRaisesRegex(TapSalesforceException, 'Report timed out'):
+                report_rest(server)._run_report(  # pylint: disable=protected-access
+                    REPORT['reportMetadata'], CATALOG_ENTRY, get_row_transform(['OPPORTUNITY_NAME', 'CLOSE_DATE']))
+
+    def test_slices_run_as_instances_in_flight_at_once(self):
+        with StandInReportInstances(running_polls=3, row_limit=10) as server:
+            rest = report_rest(server, report_slice_column='CLOSE_DATE', report_slice_concurrency=3)
+            start = time.time()
+            rows = list(rest._get_report_data(REPORT, CATALOG_ENTRY, {}))  # pylint: disable=protected-access
+
+        self.assertLess(time.time() - start, 10)
+        self.assertEqual(sorted(row['OPPORTUNITY_NAME'] for row in rows),
+                         sorted(name for name, _ in ROWS))
+        self.assertGreater(server.most_running, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
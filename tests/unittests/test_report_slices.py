@@ -0,0 +1,28 @@
+import unittest
+
+from tap_salesforce.salesforce.exceptions import TapSalesforceException
+from tap_salesforce.salesforce.report_rest import ReportRest
+
+
+class FakeSalesforce():
+    report_slice_column = 'CLOSE_DATE'
+    report_slice_concurrency = 2
+
+
+class TestReportSlices(unittest.TestCase):
+
+    def test_slice_column_with_no_values_names_the_column(self):
+        report_rest = ReportRest(FakeSalesforce())
+        report_rest._run_report = lambda *args: ([], {'allData': True})  # pylint: disable=protected-access
+        report = {
+            'reportMetadata': {'detailColumns': ['CLOSE_DATE'], 'reportFilters': []},
+            'reportExtendedMetadata': {'detailColumnInfo': {'CLOSE_DATE': {'dataType': 'date'}}},
+        }
+
+        with self.assertRaisesRegex(TapSalesforceException, 'CLOSE_DATE'):
+            list(report_rest._get_sliced_rows(  # pylint: disable=protected-access
+                report, {'stream': 'Opportunities'}, {}, None))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,174 @@
+import os
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+from tap_salesforce.salesforce import Salesforce
+from tap_salesforce.salesforce.bulk import Bulk
+from tap_salesforce.salesforce.result_buffer import ResultFileBuffer
+
+from stand_in_server import StandInServer
+
+JOB_ID = '7504x000000001'
+BATCHES_PATH = '/services/async/41.0/job/{}/batch'.format(JOB_ID)
+
+CATALOG_ENTRY = {'stream': 'Account', 'tap_stream_id': 'Account', 'metadata': []}
+
+# The result files of each batch, some larger than a small result buffer
+RESULTS = {
+    '7514x000000001': {'7524x000000001': ['001A{:05d}'.format(i) for i in range(3000)],
+                       '7524x000000002': ['001B{:05d}'.format(i) for i in range(10)]},
+    '7514x000000002': {'7524x000000003': ['001C{:05d}'.format(i) for i in range(3000)]},
+}
+
+
+def read_all(result_buffer, size=7):
+    data = b''
+    for chunk in iter(lambda: result_buffer.read(size), b''):
+        data += chunk
+    return data
+
+
+class TestResultFileBuffer(unittest.TestCase):
+
+    def test_writes_wait_while_the_buffer_is_full(self):
+        result_buffer = ResultFileBuffer(max_memory=8)
+        written = []
+
+        def write():
+            for chunk in [b'abcd', b'efgh', b'ijkl']:
+                written.append(result_buffer.write(chunk))
+            result_buffer.finish()
+
+        writer = threading.Thread(target=write)
+        writer.start()
+        writer.join(0.2)
+        self.assertTrue(writer.is_alive())
+        self.assertEqual(written, [True, True])
+
+        self.assertEqual(result_buffer.read(4), b'abcd')
+        writer.join()
+        self.assertEqual(read_all(result_buffer), b'efghijkl')
+
+    def test_reads_follow_a_writer_on_another_thread(self):
+        result_buffer = ResultFileBuffer(max_memory=16)
+        chunks = [str(i).encode('utf-8') * 5 for i in range(500)]
+
+        def write():
+            for chunk in chunks:
+                result_buffer.write(chunk)
+            result_buffer.finish()
+
+        writer = threading.Thread(target=write)
+        writer.start()
+        data = read_all(result_buffer)
+        writer.join()
+
+        self.assertEqual(data, b''.join(chunks))
+
+    def test_error_is_raised_after_the_data_written_before_it(self):
+        result_buffer = ResultFileBuffer(max_memory=4)
+        result_buffer.write(b'abcdef')
+        result_buffer.finish(ConnectionError('reset'))
+
+        self.assertEqual(result_buffer.read(10), b'abcdef')
+        with self.assertRaisesRegex(ConnectionError, 'reset'):
+            result_buffer.read(10)
+
+    def test_close_stops_the_writer(self):
+        with ResultFileBuffer(max_memory=4) as result_buffer:
+            self.assertTrue(result_buffer.write(b'abcdef'))
+            writer = threading.Thread(target=result_buffer.write, args=(b'ghi',))
+            writer.start()
+
+        writer.join()
+        self.assertFalse(result_buffer.write(b'jkl'))
+        self.assertEqual(result_buffer.read(10), b'')
+
+
+class StandInBulk(StandInServer):
+    """Serves the result lists and result files of a completed Bulk job."""
+
+    def __init__(self):
+        super().__init__()
+        self.downloaded = set()
+        for batch_id, results in RESULTS.items():
+            result_list = ''.join('<result>{}</result>'.format(result) for result in results)
+            self.route('GET', '{}/{}/result'.format(BATCHES_PATH, batch_id),
+                       lambda request, body=result_list: (200, {}, '<result-list>{}</result-list>'.format(body).encode('utf-8')))
+            for result, ids in results.items():
+                body = ('"Id"\n' + ''.join('"{}"\n'.format(i) for i in ids)).encode('utf-8')
+                self.route('GET', '{}/{}/result/{}'.format(BATCHES_PATH, batch_id, result),
+                           lambda request, body=body: (200, {'Content-Type': 'text/csv'}, body))
+
+
+def bulk(server, **config):
+    sf = Salesforce(default_start_date='2020-01-01T00:00:00Z',
+                    source_type='object',
+                    object_name='Account',
+                    bulk_result_chunk_size=1024,
+                    **config)
+    sf.access_token = 'token'
+    sf.instance_url = server.url
+    return Bulk(sf)
+
+
+@mock.patch('tap_salesforce.salesforce.bulk.RESULT_BUFFER_MEMORY', 4096)
+class TestIterBatchesResults(unittest.TestCase):
+
+    def assert_reads_every_batch_in_order(self, **config):
+        with StandInBulk() as server:
+            batches = bulk(server, **config).iter_batches_results(JOB_ID, list(RESULTS), CATALOG_ENTRY)
+            read = [(batch_id, [rec['Id'] for rec in records]) for batch_id, records in batches]
+
+        self.assertEqual(read, [(batch_id, [i for ids in results.values() for i in ids])
+                                for batch_id, results in RESULTS.items()])
+
+    def test_streamed_result_files_are_read_in_order(self):
+        self.assert_reads_every_batch_in_order()
+
+    def test_spilled_result_files_are_read_in_order(self):
+        self.assert_reads_every_batch_in_order(bulk_spill_to_disk=True)
+
+    def test_one_result_file_is_streamed_ahead_of_the_parser(self):
+        with StandInBulk() as server:
+            batches = bulk(server, bulk_result_download_concurrency=4).iter_batches_results(
+                JOB_ID, list(RESULTS), CATALOG_ENTRY)
+            _, records = next(batches)
+            next(records)
+            time.sleep(0.2)
+            self.assertEqual(len([r for r in server.requests if '/result/' in r.path]), 2)
+            batches.close()
+
+        self.assertFalse([r for r in server.requests if r.path.endswith('/result/7524x000000003')])
+
+
+    def test_spill_file_is_deleted_when_its_download_fails(self):
+        spill_files = []
+
+        def named_temporary_file(*args, **kwargs):
+            spill_files.append(tempfile.NamedTemporaryFile(*args, **kwargs))  # pylint: disable=consider-using-with
+            return spill_files[-1]
+
+        def failing_chunks(self, response):  # pylint: disable=unused-argument
+            yield b'"Id"\n'
+            raise ValueError('stream reset')
+
+        with StandInBulk() as server, \
+             mock.patch('tap_salesforce.salesforce.bulk.tempfile.NamedTemporaryFile', named_temporary_file), \
+             mock.patch.object(Bulk, '_iter_result_file_chunks', failing_chunks):
+            batches = bulk(server, bulk_spill_to_disk=True).iter_batches_results(JOB_ID, list(RESULTS), CATALOG_ENTRY)
+            with self.assertRaisesRegex(ValueError, 'stream reset'):
+                for _, records in batches:
+                    list(records)
+
+        self.assertTrue(spill_files)
+        for spill_file in spill_files:
+            self.assertTrue(spill_file.closed)
+            self.assertFalse(os.path.exists(spill_file.name))
+
+
+if __name__ == '__main__':
+    unittest.main()
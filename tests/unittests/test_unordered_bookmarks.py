@@ -0,0 +1,94 @@
+import contextlib
+import io
+import json
+import unittest
+
+import singer
+
+from tap_salesforce.sync import sync_records
+
+
+def catalog_entry(tap_stream_id, replication_key=None):
+    mdata = {'replication-method': 'INCREMENTAL' if replication_key else 'FULL_TABLE'}
+    if replication_key:
+        mdata['replication-key'] = replication_key
+    return {
+        'stream': tap_stream_id,
+        'tap_stream_id': tap_stream_id,
+        'schema': {'type': 'object', 'properties': {
+            'Id': {'type': 'string'},
+            'SystemModstamp': {'anyOf': [{'type': 'string', 'format': 'date-time'},
+                                         {'type': ['string', 'null']}]}}},
+        'metadata': [{'breadcrumb': (), 'metadata': mdata}],
+    }
+
+
+class FakeSalesforce():
+    """Yields each stream's records, marking the state of the streams in
+    unordered as a chunked Bulk query does."""
+    state_checkpoint_records = 1
+    state_checkpoint_seconds = 0
+
+    def __init__(self, records, unordered=()):
+        self.records = records
+        self.unordered = unordered
+
+    def get_start_date(self, state, catalog_entry):
+        return singer.get_bookmark(state, catalog_entry['tap_stream_id'], 'SystemModstamp') or \
+            '2020-01-01T00:00:00Z'
+
+    def query(self, catalog_entry, state):
+        tap_stream_id = catalog_entry['tap_stream_id']
+        if tap_stream_id in self.unordered:
+            singer.write_bookmark(state, tap_stream_id, 'JobHighestBookmarkSeen',
+                                  self.get_start_date(state, catalog_entry))
+        yield from self.records[tap_stream_id]
+
+
+def record(modstamp):
+    return {'Id': '001000000000001', 'SystemModstamp': modstamp}
+
+
+def sync(sf, entry, state):
+    """Returns the bookmarks of the STATE messages written while syncing."""
+    stdout = io.StringIO()
+    with contextlib.redirect_stdout(stdout):
+        sync_records(sf, entry, state, singer.metrics.Counter('record_count'))
+    messages = [json.loads(line) for line in stdout.getvalue().splitlines()]
+    return [m['value']['bookmarks'] for m in messages if m['type'] == 'STATE']
+
+
+class TestUnorderedBookmarks(unittest.TestCase):
+
+    def setUp(self):
+        self.sf = FakeSalesforce({
+            'Chunked': [record('2021-01-03T00:00:00.000Z'), record('2021-01-01T00:00:00.000Z')],
+            'Ordered': [record('2021-01-01T00:00:00.000Z'), record('2021-01-02T00:00:00.000Z')],
+            'FullTable': [record('2021-01-01T00:00:00.000Z')],
+        }, unordered={'Chunked', 'FullTable'})
+
+    def test_unordered_stream_writes_the_highest_bookmark_at_the_end(self):
+        state = {}
+        written = sync(self.sf, catalog_entry('Chunked', 'SystemModstamp'), state)
+        self.assertTrue(written)
+        self.assertFalse([b for b in written if 'SystemModstamp' in b['Chunked']])
+        self.assertEqual(singer.get_bookmark(state, 'Chunked', 'SystemModstamp'),
+                         '2021-01-03T00:00:00.000000Z')
+
+    def test_ordered_stream_after_an_unordered_one_writes_bookmarks_as_it_goes(self):
+        state = {}
+        sync(self.sf, catalog_entry('Chunked', 'SystemModstamp'), state)
+        written = sync(self.sf, catalog_entry('Ordered', 'SystemModstamp'), state)
+        self.assertEqual(written[0]['Ordered']['SystemModstamp'], '2021-01-01T00:00:00.000000Z')
+        self.assertEqual(singer.get_bookmark(state, 'Ordered', 'SystemModstamp'),
+                         '2021-01-02T00:00:00.000000Z')
+        self.assertIsNone(singer.get_bookmark(state, 'Ordered', 'JobHighestBookmarkSeen'))
+
+    def test_unordered_full_table_stream_writes_no_replication_key_bookmark(self):
+        state = {}
+        sync(self.sf, catalog_entry('FullTable'), state)
+        self.assertNotIn(None, state['bookmarks']['FullTable'])
+
+
+if __name__ == '__main__':
+    unittest.main()